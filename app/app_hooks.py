@@ -0,0 +1,46 @@
+import logging
+import os
+
+from datasets.refresh import DataRefresher
+from datasets.store import data_store
+from metrics import registry, rss_bytes
+from tabs.local_uk import warm_local_uk
+from tabs.scheduling import render_stats
+from tabs.summary import warm_summary
+from tabs.time_evolution import warm_time_evolution
+
+
+log = logging.getLogger(__name__)
+
+refresher = DataRefresher(
+                data_store,
+                interval=float(os.getenv('DATA_REFRESH_INTERVAL', 900)))
+
+
+def on_server_loaded(server_context):
+
+    # Load every dataset once, ahead of the first session, with what the
+    # tabs derive from them built before each snapshot is swapped in
+    for warm in (warm_summary, warm_time_evolution, warm_local_uk):
+        data_store.add_warmer(warm)
+    data_store.refresh()
+
+    # Memory grown past this is counted against the sessions
+    registry.baseline_rss = rss_bytes()
+
+    # Keep the datasets fresh in the background
+    refresher.start()
+
+
+def on_server_unloaded(server_context):
+    refresher.stop()
+
+
+def on_session_created(session_context):
+    registry.session_created()
+    log.debug("Data store stats: %s", data_store.stats())
+    log.debug("Time evolution render stats: %s", render_stats())
+
+
+def on_session_destroyed(session_context):
+    registry.session_destroyed()
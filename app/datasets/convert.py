@@ -0,0 +1,81 @@
+"""Convert the tabular CSV datasets into typed columnar artifacts.
+
+Run from the app directory, e.g.
+
+    python -m datasets.convert --format parquet --dest ../columnar
+
+The artifacts are written under data/_columnar/ in the destination
+directory, mirroring their bucket keys, and uploaded to the bucket
+with --upload. Each records the ETag of the CSV it was converted from,
+so the app falls back to the CSV once it changes, until the artifacts
+are converted again.
+"""
+import argparse
+import io
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from datasets.loaders import (
+    COLUMNAR_DATASETS, COLUMNAR_FORMATS, S3_BUCKET, SOURCE_ETAG_KEY,
+    data_client, columnar_key, load_dataset, s3_client)
+
+
+def serialise(df, data_format, source_etag):
+
+    table = pa.Table.from_pandas(df.reset_index(drop=True),
+                                 preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_ETAG_KEY] = source_etag.encode()
+    table = table.replace_schema_metadata(metadata)
+
+    buffer = io.BytesIO()
+
+    if data_format == 'parquet':
+        pq.write_table(table, buffer)
+    elif data_format == 'arrow':
+        feather.write_feather(table, buffer)
+
+    return buffer.getvalue()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--format', choices=list(COLUMNAR_FORMATS),
+                        default='parquet')
+    parser.add_argument('--dest', default=os.getenv('DATA_BUCKET_DIR', '.'),
+                        help="directory to write artifacts under")
+    parser.add_argument('--upload', action='store_true',
+                        help="also upload artifacts to the S3 bucket")
+    args = parser.parse_args()
+
+    client = data_client()
+
+    for name in COLUMNAR_DATASETS:
+
+        start = time.perf_counter()
+
+        # Always parse from CSV, so artifacts carry the cleaned-up dtypes
+        df, source_etag = load_dataset(client, name, data_format='csv')
+        body = serialise(df, args.format, source_etag)
+
+        key = columnar_key(name, args.format)
+        path = os.path.join(args.dest, *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as f:
+            f.write(body)
+
+        if args.upload:
+            s3_client().put_object(Bucket=S3_BUCKET, Key=key, Body=body)
+
+        print(f"{name}: {len(df):,} rows, {len(body) / 1e6:.2f} MB, "
+              f"{time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Build the structures the tabs derive from the raw datasets, offline.
+
+Run from the app directory, e.g.
+
+    DATA_BUCKET_DIR=/path/to/bucket python -m datasets.etl
+
+Produces, under data/_derived/ in the destination directory:
+
+- continents_<data view>: continent pivots with global totals, as plotted
+  by the summary tab.
+- geo_time_evolution_sized: time evolution rows sorted by date, with the
+  bubble size of every data view.
+- country_rankings: top countries of every date and data view.
+- local_uk_rates: daily cases of every local authority, with weekly cases
+  per 100,000.
+
+Each stage builds the same structure as the tab plotting it
+(ContinentHistory, DateIndex, ChoroplethFrames), so the artifacts hold
+exactly what the app shows.
+
+Every artifact is a directory of parquet parts, one per run, numbered in
+the order they were written and named after the first and last date they
+cover. Each stage reprocesses a trailing window of --window days before
+the last date already built, so rows published late for those dates are
+picked up, along with the dates after it, and writes them as a new part
+when they changed. Rows of a part replace those of earlier parts from its
+first date on. Use --full to rebuild from scratch, e.g. after data older
+than the window was revised.
+
+The app doesn't read these artifacts: they're built for offline analysis
+and to time the derivations outside of a session.
+"""
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from datasets.loaders import S3_BUCKET, data_client, load_dataset, s3_client
+from datasets.views import CONTINENT_DATA_VIEWS, COUNTRY_DATA_VIEWS
+from tabs.local_uk import ChoroplethFrames
+from tabs.summary import ContinentHistory
+from tabs.time_evolution import DateIndex
+
+PART_DATE_FORMAT = '%Y%m%d'
+
+
+def artifact_key(name):
+    return f'data/_derived/{name}'
+
+
+def artifact_dir(root, name):
+    return os.path.join(root, *artifact_key(name).split('/'))
+
+
+def parts(root, name):
+
+    """Paths of an artifact's parts, in the order they were written."""
+
+    directory = artifact_dir(root, name)
+    if not os.path.isdir(directory):
+        return []
+
+    return sorted(os.path.join(directory, part)
+                  for part in os.listdir(directory)
+                  if part.endswith('.parquet'))
+
+
+def part_dates(path):
+
+    """First and last date covered by a part."""
+
+    _, first, last = os.path.basename(path)[:-len('.parquet')].split('-')
+
+    return (pd.to_datetime(first, format=PART_DATE_FORMAT),
+            pd.to_datetime(last, format=PART_DATE_FORMAT))
+
+
+def last_date(root, name):
+
+    """Last date built for an artifact, None if it was never built."""
+
+    artifact_parts = parts(root, name)
+    if not artifact_parts:
+        return None
+
+    return max(part_dates(part)[1] for part in artifact_parts)
+
+
+def read_artifact(root, name, since=None):
+
+    """Rows of an artifact, after the date since if given.
+
+        Parts are read newest first, each keeping only the dates before
+        the first date of the parts written after it.
+    """
+
+    dfs = []
+    cutoff = None
+    for part in reversed(parts(root, name)):
+        first, last = part_dates(part)
+        if since is not None and last <= since:
+            break
+
+        df = pd.read_parquet(part)
+        if cutoff is not None:
+            df = df.loc[df.date < cutoff]
+        if since is not None:
+            df = df.loc[df.date > since]
+
+        dfs.append(df)
+        cutoff = first if cutoff is None else min(cutoff, first)
+
+    if not dfs:
+        return None
+
+    return pd.concat(dfs[::-1], ignore_index=True)
+
+
+def since_date(df, since):
+    return df if since is None else df.loc[df.date > since]
+
+
+def continent_pivots(datasets, since):
+
+    # Pivoted as the summary tab does, keeping the daily resolution
+    history = ContinentHistory(
+                since_date(datasets['continents_by_day'], since),
+                since_date(datasets['vaccinations_by_continent'], since))
+
+    artifacts = {}
+    for data_view in CONTINENT_DATA_VIEWS:
+        columns = history.bars(data_view, 'daily')
+
+        continents_pivot_df = pd.DataFrame(
+                        {continent: columns[continent]
+                         for continent in history.continent_names + ['total']})
+        continents_pivot_df.insert(
+                        0, 'date', pd.to_datetime(columns['date'], unit='ms'))
+
+        artifacts[f'continents_{data_view}'] = continents_pivot_df
+
+    return artifacts
+
+
+def country_snapshots(datasets, since):
+
+    # Indexed and ranked as the time evolution tab does
+    date_index = DateIndex(since_date(datasets['geo_time_evolution'], since),
+                           datasets['global_by_day'])
+
+    time_evol_df = pd.DataFrame(date_index.columns)
+    for data_view in COUNTRY_DATA_VIEWS:
+        time_evol_df[f'size_{data_view}'] = date_index.sizes[data_view]
+
+    rankings = []
+    for data_view in COUNTRY_DATA_VIEWS:
+        offsets, regions, values = date_index.rankings[data_view]
+        counts = np.diff(offsets)
+
+        rankings.append(pd.DataFrame({
+                            'date': np.repeat(date_index.dates, counts),
+                            'data_view': data_view,
+                            'rank': (np.arange(len(values))
+                                     - np.repeat(offsets[:-1], counts)
+                                     ).astype('int8'),
+                            'region': regions.astype(str),
+                            'value': values}))
+
+    return {'geo_time_evolution_sized': time_evol_df,
+            'country_rankings': pd.concat(rankings, ignore_index=True)}
+
+
+def la_weekly_rates(datasets, since):
+
+    la_cases_df = since_date(datasets['local_uk'], since)
+
+    area_codes = np.sort(la_cases_df.area_code.unique().astype(str))
+    population = (datasets['la_populations'].drop_duplicates('code')
+                  .set_index('code')['population'].reindex(area_codes))
+
+    # Joined and coloured as the local UK tab's map does
+    frames = ChoroplethFrames(la_cases_df, area_codes, population.values)
+
+    la_rates_df = pd.DataFrame({
+                    'date': np.repeat(frames.dates, len(area_codes)),
+                    'area_code': np.tile(area_codes, len(frames.dates)),
+                    'new_cases': frames.new_cases.ravel(),
+                    'cases_per_pop': frames.cases_per_pop.ravel()})
+
+    # Authorities missing on a date have no cases to report
+    return {'local_uk_rates': la_rates_df.loc[la_rates_df.new_cases.notna()]
+                                         .reset_index(drop=True)}
+
+
+# Every stage, with the raw datasets it reads and the artifacts it builds
+STAGES = {
+    'continent_pivots': (
+        ['continents_by_day', 'vaccinations_by_continent'],
+        [f'continents_{data_view}' for data_view in CONTINENT_DATA_VIEWS],
+        continent_pivots),
+    'country_snapshots': (
+        ['geo_time_evolution', 'global_by_day'],
+        ['geo_time_evolution_sized', 'country_rankings'],
+        country_snapshots),
+    'la_weekly_rates': (
+        ['local_uk', 'la_populations'],
+        ['local_uk_rates'],
+        la_weekly_rates),
+}
+
+
+def unchanged(root, name, df, since):
+
+    """Whether an artifact already holds exactly these rows after since."""
+
+    built_df = read_artifact(root, name, since)
+    if built_df is None or len(built_df) != len(df):
+        return False
+
+    try:
+        pd.testing.assert_frame_equal(
+                    built_df, df.reset_index(drop=True),
+                    check_dtype=False, check_categorical=False)
+    except AssertionError:
+        return False
+
+    return True
+
+
+def write_part(root, name, df, first, upload=False):
+
+    # Parts are numbered after those already written, so they're read in
+    # order, and cover their dates from first on
+    artifact_parts = parts(root, name)
+    number = (int(os.path.basename(artifact_parts[-1]).split('-')[0]) + 1
+              if artifact_parts else 1)
+
+    part_name = (f'{number:06d}-{first.strftime(PART_DATE_FORMAT)}-'
+                 f'{df.date.max().strftime(PART_DATE_FORMAT)}.parquet')
+
+    directory = artifact_dir(root, name)
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, part_name)
+    df.to_parquet(path, index=False)
+
+    if upload:
+        with open(path, 'rb') as f:
+            s3_client().put_object(
+                Bucket=S3_BUCKET,
+                Key=f'{artifact_key(name)}/{part_name}',
+                Body=f.read())
+
+    return path
+
+
+def run_stage(client, stage, dest, datasets, window, full=False,
+              upload=False):
+
+    sources, artifacts, build = STAGES[stage]
+
+    if full:
+        for name in artifacts:
+            shutil.rmtree(artifact_dir(dest, name), ignore_errors=True)
+
+    # Resume from the artifact furthest behind, so none has gaps, going
+    # back a window of days for rows published late
+    last_dates = [last_date(dest, name) for name in artifacts]
+    since = (None if None in last_dates
+             else min(last_dates) - pd.Timedelta(days=window))
+
+    for name in sources:
+        if name not in datasets:
+            start = time.perf_counter()
+            datasets[name], _ = load_dataset(client, name)
+            print(f"load {name}: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    built = build(datasets, since)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = 0
+    for name, df in built.items():
+        if df.empty or unchanged(dest, name, df, since):
+            continue
+
+        first = (since + pd.Timedelta(days=1) if since is not None
+                 else df.date.min())
+        write_part(dest, name, df, first, upload)
+        rows += len(df)
+
+    print(f"{stage}: {rows:,} rows written for dates after "
+          f"{since.date() if since is not None else 'start'}, "
+          f"built in {build_seconds:.2f}s, "
+          f"written in {time.perf_counter() - start:.2f}s")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dest', default=os.getenv('DATA_BUCKET_DIR', '.'),
+                        help="directory to write artifacts under")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES),
+                        default=list(STAGES))
+    parser.add_argument('--window', type=int, default=14,
+                        help="days before the last date built to "
+                             "reprocess, for rows published late")
+    parser.add_argument('--full', action='store_true',
+                        help="rebuild every artifact from scratch")
+    parser.add_argument('--upload', action='store_true',
+                        help="also upload new parts to the S3 bucket")
+    args = parser.parse_args()
+
+    client = data_client()
+    datasets = {}
+
+    start = time.perf_counter()
+    for stage in args.stages:
+        run_stage(client, stage, args.dest, datasets, args.window,
+                  args.full, args.upload)
+
+    print(f"ETL finished in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+import logging
+import math
+import numbers
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import LineString, MultiPolygon, Polygon, box
+from shapely.strtree import STRtree
+
+from metrics import span
+
+
+log = logging.getLogger(__name__)
+
+# Simplification tolerance in metres for each level of detail, with
+# coordinates rounded to a tenth of the tolerance first
+LEVELS_OF_DETAIL = {
+    'full': None,
+    'high': 100,
+    'medium': 500,
+    'low': 2500,
+}
+
+METRES_PER_DEGREE = 111320
+
+# BokehJS rejects a FeatureCollection without features, so nothing is
+# drawn with a single feature without coordinates
+EMPTY_GEOJSON = ('{"type": "FeatureCollection", "features": [{"type": '
+                 '"Feature", "properties": {}, "geometry": {"type": '
+                 '"LineString", "coordinates": []}}]}')
+
+
+def _in_crs_units(gdf, metres):
+    if gdf.crs is None or gdf.crs.is_geographic:
+        return metres / METRES_PER_DEGREE
+    return metres
+
+
+def _edge(a, b):
+    return (a, b) if a < b else (b, a)
+
+
+class _Topology:
+
+    """Rings of a set of polygons, split into arcs at their junctions.
+
+        Coordinates are rounded before the rings are compared, so borders
+        shared by neighbouring polygons have identical vertices. A vertex
+        is a junction where the rings sharing the edges either side of it
+        change, or where more than two edges meet. Each arc between
+        junctions is simplified once, and shared by every ring along it,
+        so neighbours keep a common border without gaps or overlaps.
+    """
+
+    def __init__(self, rings, tolerance):
+
+        self._tolerance = tolerance
+        self._rings = rings
+        self._arcs = {}
+
+        self._edge_rings = {}
+        self._neighbours = {}
+
+        for r, ring in enumerate(rings):
+            for i in range(len(ring)):
+                a, b = ring[i - 1], ring[i]
+                self._edge_rings.setdefault(_edge(a, b), set()).add(r)
+                self._neighbours.setdefault(a, set()).add(b)
+                self._neighbours.setdefault(b, set()).add(a)
+
+    def _is_junction(self, ring, i):
+
+        before = self._edge_rings[_edge(ring[i - 1], ring[i])]
+        after = self._edge_rings[_edge(ring[i], ring[(i + 1) % len(ring)])]
+
+        return before != after or len(self._neighbours[ring[i]]) > 2
+
+    def _simplified_arc(self, arc):
+
+        # Arcs are simplified in one direction, whichever way they're walked
+        arc = tuple(arc)
+        reverse = arc[::-1]
+        key = min(arc, reverse)
+
+        if key not in self._arcs:
+            self._arcs[key] = [tuple(coords) for coords in LineString(
+                                    key).simplify(self._tolerance,
+                                                  preserve_topology=False
+                                                  ).coords]
+
+        return self._arcs[key] if key == arc else self._arcs[key][::-1]
+
+    def simplified_ring(self, r):
+
+        """Closed coordinates of a ring, simplified along its arcs."""
+
+        ring = self._rings[r]
+        junctions = [i for i in range(len(ring))
+                     if self._is_junction(ring, i)]
+
+        if junctions:
+            start = junctions[0]
+            ends = junctions[1:] + [start + len(ring)]
+        else:
+            # A ring sharing no junctions is one arc, started from its
+            # lowest vertex so any ring along it is walked the same way
+            start = ring.index(min(ring))
+            ends = [start + len(ring)]
+
+        coords = [ring[start]]
+        for end in ends:
+            arc = [ring[i % len(ring)] for i in range(start, end + 1)]
+            coords += self._simplified_arc(arc)[1:]
+            start = end
+
+        # Rings collapsed by simplification are kept as they were
+        if len(set(coords)) < 3:
+            return ring + [ring[0]]
+
+        return coords
+
+
+def _rings(geom):
+
+    polygons = list(getattr(geom, 'geoms', [geom]))
+
+    return [[polygon.exterior] + list(polygon.interiors)
+            for polygon in polygons]
+
+
+def _rounded_ring(ring, decimals):
+
+    coords = np.round(np.asarray(ring.coords)[:, :2], decimals)
+
+    # Rounding may merge consecutive vertices, and rings are held open
+    keep = np.append(True, np.any(coords[1:] != coords[:-1], axis=1))
+    coords = [tuple(vertex) for vertex in coords[keep].tolist()]
+
+    return coords[:-1] if coords[0] == coords[-1] else coords
+
+
+def simplify(gdf, level):
+
+    """Simplification of a GeoDataFrame's polygons sharing their borders.
+
+        Coordinates are rounded to a tenth of the level's tolerance, which
+        shortens the serialised GeoJSON, then the polygons' rings are
+        simplified at the tolerance along the arcs between junctions (see
+        _Topology), so neighbouring polygons keep a common border.
+        Polygons left invalid by simplification are repaired with a zero
+        buffer.
+    """
+
+    if LEVELS_OF_DETAIL[level] is None:
+        return gdf
+
+    tolerance = _in_crs_units(gdf, LEVELS_OF_DETAIL[level])
+    decimals = max(0, math.ceil(-math.log10(tolerance / 10)))
+
+    # Rings of every polygon, rounded, with where they belong
+    rings = []
+    layout = []
+    for geom in gdf.geometry:
+        if geom is None or geom.is_empty:
+            layout.append(None)
+            continue
+
+        parts = []
+        for polygon_rings in _rings(geom):
+            part = []
+            for ring in polygon_rings:
+                coords = _rounded_ring(ring, decimals)
+                if len(coords) >= 3:
+                    part.append(len(rings))
+                    rings.append(coords)
+            if part:
+                parts.append(part)
+        layout.append(parts)
+
+    topology = _Topology(rings, tolerance)
+
+    geoms = []
+    repaired = 0
+    for geom, parts in zip(gdf.geometry, layout):
+        if not parts:
+            geoms.append(geom)
+            continue
+
+        polygons = [Polygon(topology.simplified_ring(part[0]),
+                            [topology.simplified_ring(r) for r in part[1:]])
+                    for part in parts]
+        simplified_geom = (polygons[0] if len(polygons) == 1
+                           else MultiPolygon(polygons))
+
+        if not simplified_geom.is_valid:
+            simplified_geom = simplified_geom.buffer(0)
+            repaired += 1
+        geoms.append(simplified_geom)
+
+    if repaired:
+        log.info("Repaired %d geometries invalid after simplification",
+                 repaired)
+
+    simplified_gdf = gdf.copy()
+    simplified_gdf[gdf.geometry.name] = gpd.GeoSeries(
+                                            geoms, index=gdf.index,
+                                            crs=gdf.crs)
+
+    return simplified_gdf
+
+
+def patch_coordinates(gdf):
+
+    """Patch xs/ys of every geometry, for a plain ColumnDataSource.
+
+        Parts of multi-polygons are separated by NaN, and holes are
+        dropped, as GeoJSONDataSource does for patches.
+    """
+
+    xs = []
+    ys = []
+
+    for geom in gdf.geometry:
+        parts = (list(getattr(geom, 'geoms', [geom]))
+                 if geom is not None else [])
+
+        x_parts = []
+        y_parts = []
+        for part in parts:
+            x, y = part.exterior.coords.xy
+            x_parts += [np.asarray(x), [np.nan]]
+            y_parts += [np.asarray(y), [np.nan]]
+
+        xs.append(np.concatenate(x_parts[:-1]) if parts else np.array([]))
+        ys.append(np.concatenate(y_parts[:-1]) if parts else np.array([]))
+
+    return xs, ys
+
+
+class SpatialIndex:
+
+    """STRtree over the geometries of a GeoDataFrame, queried for rows.
+
+        query() returns the positions of the rows whose bounding boxes
+        intersect a geometry's, for callers to test exactly. Missing and
+        empty geometries are left out of the tree.
+    """
+
+    def __init__(self, gdf):
+
+        self._positions = np.array(
+                            [i for i, geom in enumerate(gdf.geometry)
+                             if geom is not None and not geom.is_empty],
+                            dtype=int)
+        geoms = [gdf.geometry.iloc[i] for i in self._positions]
+
+        self._tree = STRtree(geoms)
+
+        # Queries return the geometries themselves before Shapely 2
+        self._by_id = {id(geom): i
+                       for geom, i in zip(geoms, self._positions)}
+
+    def query(self, geom):
+
+        hits = self._tree.query(geom)
+
+        if len(hits) and not isinstance(hits[0], numbers.Integral):
+            return np.sort([self._by_id[id(hit)] for hit in hits])
+
+        return np.sort(self._positions[np.asarray(hits, dtype=int)])
+
+
+def _polygons(geom):
+
+    # Clipping leaves lines and points where outlines touch the box
+    if geom is None or geom.is_empty:
+        return None
+    if geom.geom_type in ('Polygon', 'MultiPolygon'):
+        return geom
+
+    parts = []
+    for part in getattr(geom, 'geoms', []):
+        if part.geom_type == 'Polygon':
+            parts.append(part)
+        elif part.geom_type == 'MultiPolygon':
+            parts.extend(part.geoms)
+
+    return MultiPolygon(parts) if parts else None
+
+
+def _with_geometry(gdf, geoms):
+
+    geoms = [_polygons(geom) for geom in geoms]
+    keep = [geom is not None for geom in geoms]
+
+    clipped_gdf = gdf.copy()
+    clipped_gdf[gdf.geometry.name] = gpd.GeoSeries(
+                                        geoms, index=gdf.index, crs=gdf.crs)
+
+    return clipped_gdf.loc[keep]
+
+
+def clip(gdf, index, viewport):
+
+    """Geometries of gdf clipped to the viewport, found with its index."""
+
+    rows = index.query(viewport)
+    within_gdf = gdf.iloc[rows]
+
+    return _with_geometry(
+                within_gdf,
+                [geom.intersection(viewport) for geom in within_gdf.geometry])
+
+
+def cut(gdf, viewport):
+
+    """Geometries of gdf with the viewport cut out of them."""
+
+    return _with_geometry(
+                gdf, [geom.difference(viewport) for geom in gdf.geometry])
+
+
+def to_geojson(gdf, label=''):
+
+    if gdf.empty:
+        return EMPTY_GEOJSON
+
+    start = time.perf_counter()
+    geojson = gdf.to_json()
+
+    log.info("Serialised %s GeoJSON: %.2f MB in %.2fs",
+             label, len(geojson) / 1e6, time.perf_counter() - start)
+
+    return geojson
+
+
+def simplified(snapshot, name, level):
+
+    """Simplified geometry dataset, cached for the snapshot's lifetime."""
+
+    def compute(snapshot):
+        with span('simplify', dataset=name, level=level):
+            return simplify(snapshot[name], level)
+
+    return snapshot.derive(('simplified', name, level), compute)
+
+
+def geojson(snapshot, name, level):
+
+    """Serialised GeoJSON of a geometry dataset, cached per snapshot."""
+
+    def compute(snapshot):
+        gdf = simplified(snapshot, name, level)
+        with span('to_json', dataset=name, level=level):
+            return to_geojson(gdf, f'{name} ({level})')
+
+    return snapshot.derive(('geojson', name, level), compute)
+
+
+def spatial_index(snapshot, name, level):
+
+    """Spatial index of a simplified geometry dataset, cached per snapshot."""
+
+    def compute(snapshot):
+        gdf = simplified(snapshot, name, level)
+        with span('spatial_index', dataset=name, level=level):
+            return SpatialIndex(gdf)
+
+    return snapshot.derive(('spatial_index', name, level), compute)
+
+
+def viewport_detail(snapshot, bounds, detailed, coarse):
+
+    """Detailed geometry within bounds, over a coarse layer, per snapshot.
+
+        The detailed and coarse layers are (dataset name, level) pairs
+        of the same geometry at different scales, in the same CRS.
+        Returns the rows of the coarse layer crossing bounds (xmin, ymin,
+        xmax, ymax), to be hidden from it, and the GeoJSON drawn in their
+        place:
+
+        - the detailed geometries clipped to the bounds, found with a
+          spatial index, so only the detail in view is sent
+
+        - the parts of the hidden coarse geometries outside the bounds,
+          so the map still shows land when panned away
+    """
+
+    detail_name, detail = detailed
+    coarse_name, coarse_level = coarse
+
+    def compute(snapshot):
+        viewport = box(*bounds)
+        coarse_gdf = simplified(snapshot, coarse_name, coarse_level)
+
+        with span('clip', dataset=detail_name, level=detail):
+            hidden = [int(i) for i in spatial_index(
+                                        snapshot, coarse_name, coarse_level
+                                        ).query(viewport)
+                      if coarse_gdf.geometry.iloc[i].intersects(viewport)]
+
+            inside_gdf = clip(simplified(snapshot, detail_name, detail),
+                              spatial_index(snapshot, detail_name, detail),
+                              viewport)
+            outside_gdf = cut(coarse_gdf.iloc[hidden], viewport)
+
+            gdf = gpd.GeoDataFrame(
+                        pd.concat([outside_gdf, inside_gdf],
+                                  ignore_index=True),
+                        crs=coarse_gdf.crs)
+
+        with span('to_json', dataset=detail_name, level=detail):
+            geojson = to_geojson(
+                        gdf, f'{detail_name} ({detail} within {bounds})')
+
+        return hidden, geojson
+
+    return snapshot.derive(
+                ('viewport_detail', tuple(bounds), detailed, coarse),
+                compute)
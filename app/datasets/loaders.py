@@ -0,0 +1,236 @@
+import io
+import logging
+import os
+import boto3
+import geopandas as gpd
+import pandas as pd
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+from datasets.local_bucket import LocalBucketClient
+from datasets.schema import SCHEMAS, apply_schema, memory_mb
+from metrics import span
+
+
+log = logging.getLogger(__name__)
+
+S3_BUCKET = 'covid19-bokeh-app'
+
+
+def s3_client():
+
+    return boto3.client(
+                "s3",
+                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'))
+
+
+def data_client():
+
+    """Client for the data bucket, served from DATA_BUCKET_DIR if set."""
+
+    local_root = os.getenv('DATA_BUCKET_DIR')
+    if local_root:
+        return LocalBucketClient(local_root)
+
+    return s3_client()
+
+
+def fetch_object(client, key, etag=None):
+
+    """Conditional GET of a bucket object.
+
+        Returns a (body, etag) tuple, where body is None if the object
+        still matches the given etag.
+    """
+
+    kwargs = {'IfNoneMatch': etag} if etag else {}
+
+    try:
+        response = client.get_object(Bucket=S3_BUCKET, Key=key, **kwargs)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('304', 'NotModified'):
+            return None, etag
+        raise
+
+    return io.BytesIO(response['Body'].read()), response['ETag']
+
+
+def object_etag(client, key):
+
+    """Current ETag of a bucket object, without fetching its body."""
+
+    return client.head_object(Bucket=S3_BUCKET, Key=key)['ETag']
+
+
+# Schema metadata key of a columnar artifact holding the ETag of the source
+# object it was converted from
+SOURCE_ETAG_KEY = b'source_etag'
+
+
+def parse_parquet(body):
+    return pq.read_table(body)
+
+
+def parse_arrow(body):
+    return feather.read_table(body)
+
+
+def parse_dated_csv(body):
+
+    df = pd.read_csv(body)
+
+    df.date = pd.to_datetime(df.date, format='%Y-%m-%d')
+
+    return df
+
+
+def parse_la_populations(body):
+
+    la_pop_df = pd.read_csv(body).loc[:, ['code', 'population']]
+
+    # Remove commas and convert to numeric dtype
+    la_pop_df['population'] = pd.to_numeric(
+                                    (la_pop_df['population']
+                                        .str.replace(",", "")))
+
+    return la_pop_df
+
+
+def parse_shapefile_zip(body):
+    return gpd.read_file(body)
+
+
+def parse_la_boundaries(body):
+
+    la_boundaries_gdf = gpd.read_file(body)
+
+    return la_boundaries_gdf.loc[:, ['lad19cd', 'lad19nm', 'geometry']]
+
+
+# Every dataset used by the tabs, keyed by the name the data store serves,
+# with the bucket key it is fetched from and the parser for its contents
+DATASETS = {
+    'global_by_day': (
+        'data/global_by_day.csv', parse_dated_csv),
+    'continents_by_day': (
+        'data/continents_by_day.csv', parse_dated_csv),
+    'vaccinations_by_continent': (
+        'data/vaccinations_by_continent_by_day.csv', parse_dated_csv),
+    'geo_time_evolution': (
+        'data/geo_time_evolution.csv', parse_dated_csv),
+    'local_uk': (
+        'data/local_uk.csv', parse_dated_csv),
+    'la_populations': (
+        'data/local_authority_populations.csv', parse_la_populations),
+    'world_land': (
+        'data/_geo_data/ne_50m_land.zip', parse_shapefile_zip),
+    'world_land_detailed': (
+        'data/_geo_data/ne_10m_land.zip', parse_shapefile_zip),
+    'la_boundaries': (
+        'data/_geo_data/la_districts_dec19.zip', parse_la_boundaries),
+}
+
+# Tabular datasets which may also be stored in a typed columnar format,
+# produced from the parsed CSVs by datasets.convert
+COLUMNAR_DATASETS = [
+    'global_by_day', 'continents_by_day', 'vaccinations_by_continent',
+    'geo_time_evolution', 'local_uk', 'la_populations']
+
+COLUMNAR_FORMATS = {
+    'parquet': ('.parquet', parse_parquet),
+    'arrow': ('.arrow', parse_arrow),
+}
+
+
+def columnar_key(name, data_format):
+    extension, _ = COLUMNAR_FORMATS[data_format]
+    return f'data/_columnar/{name}{extension}'
+
+
+def compact(df, name):
+
+    """Apply the dataset's schema, logging its memory before and after."""
+
+    if name not in SCHEMAS:
+        return df
+
+    before = memory_mb(df)
+    df = apply_schema(df, name)
+
+    log.info("Compacted dataset %s from %.1f MB to %.1f MB",
+             name, before, memory_mb(df))
+
+    return df
+
+
+def load_columnar(client, name, data_format, source_etag):
+
+    """Columnar version of a dataset converted from the given source ETag.
+
+        Returns None when the bucket holds no columnar version, or one
+        converted from an earlier version of the source object.
+    """
+
+    _, parse = COLUMNAR_FORMATS[data_format]
+
+    try:
+        with span('fetch_columnar', dataset=name, format=data_format):
+            body, _ = fetch_object(client, columnar_key(name, data_format))
+    except ClientError as e:
+        # Without s3:ListBucket, S3 denies access to missing objects
+        # rather than reporting them missing
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404',
+                                               'AccessDenied', '403'):
+            raise
+        return None
+
+    with span('parse_columnar', dataset=name, format=data_format):
+        table = parse(body)
+        metadata = table.schema.metadata or {}
+
+        if metadata.get(SOURCE_ETAG_KEY, b'').decode() != source_etag:
+            log.warning("Columnar %s of dataset %s is stale, loading "
+                        "its source instead", data_format, name)
+            return None
+
+        return compact(table.to_pandas(), name)
+
+
+def load_dataset(client, name, etag=None, data_format=None):
+
+    """Conditional load of a dataset, or of its columnar version.
+
+        Returns a (value, etag) tuple, where value is None if the dataset
+        still matches the given etag. The etag is always the source CSV
+        (or shapefile) object's, which columnar versions record when they
+        are converted. A columnar version is only tried when data_format
+        (DATA_FORMAT, csv by default) names one, falling back to the
+        source object when none of its current contents exists in the
+        bucket. Tabular datasets are compacted to the dtypes of their
+        schema.
+    """
+
+    data_format = data_format or os.getenv('DATA_FORMAT', 'csv')
+    key, parse = DATASETS[name]
+
+    if name in COLUMNAR_DATASETS and data_format in COLUMNAR_FORMATS:
+        with span('head', dataset=name):
+            source_etag = object_etag(client, key)
+
+        if source_etag == etag:
+            return None, etag
+
+        df = load_columnar(client, name, data_format, source_etag)
+        if df is not None:
+            return df, source_etag
+
+    with span('fetch', dataset=name):
+        body, etag = fetch_object(client, key, etag)
+
+    if body is None:
+        return None, etag
+
+    with span('parse', dataset=name):
+        return compact(parse(body), name), etag
@@ -0,0 +1,57 @@
+import io
+import os
+
+from botocore.exceptions import ClientError
+
+
+class LocalBucketClient:
+
+    """Stand-in for the boto3 S3 client, serving objects from a directory.
+
+        - Keys map onto paths relative to the root directory, so a copy of
+          the bucket can be served as-is, e.g. for local development or to
+          exercise the refresher without network access.
+
+        - ETags are derived from file size and modification time, and
+          conditional requests raise the same 304 ClientError as S3.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def _etag(self, Key, operation):
+
+        path = self._path(Key)
+
+        if not os.path.isfile(path):
+            raise ClientError(
+                    {'Error': {'Code': 'NoSuchKey',
+                               'Message': f'{Key} not found'}},
+                    operation)
+
+        stat = os.stat(path)
+
+        return path, f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def head_object(self, Bucket, Key):
+
+        _, etag = self._etag(Key, 'HeadObject')
+
+        return {'ETag': etag}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+
+        path, etag = self._etag(Key, 'GetObject')
+
+        if IfNoneMatch == etag:
+            raise ClientError(
+                    {'Error': {'Code': '304', 'Message': 'Not Modified'}},
+                    'GetObject')
+
+        with open(path, 'rb') as f:
+            body = io.BytesIO(f.read())
+
+        return {'Body': body, 'ETag': etag}
@@ -0,0 +1,45 @@
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class DataRefresher:
+
+    """Background thread periodically refreshing a data store.
+
+        Refreshes run off the server's event loop, so sessions keep being
+        served the current snapshot while changed datasets are re-parsed.
+    """
+
+    def __init__(self, store, interval):
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                changed = self.store.refresh()
+            except Exception:
+                log.exception("Background data refresh failed")
+                continue
+
+            if changed:
+                log.info("Refreshed datasets: %s", ", ".join(changed))
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+                            target=self._run,
+                            name="data-refresher",
+                            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+# Compact in-memory dtypes of the largest tabular datasets. Strings are
+# held as categoricals, counts as the smallest of int32/int64 that fits
+# (left as float64 when missing values are present), and coordinates and
+# averages as float32.
+SCHEMAS = {
+    'geo_time_evolution': {
+        'region': 'category',
+        'province': 'category',
+        'lat': 'float32',
+        'long': 'float32',
+        'cases': 'integer',
+        'deaths': 'integer',
+        'new_cases': 'integer',
+        'new_deaths': 'integer',
+    },
+    'local_uk': {
+        'area_name': 'category',
+        'area_code': 'category',
+        'new_cases': 'integer',
+        'weekly_cases': 'integer',
+        'weekly_average': 'float32',
+    },
+}
+
+
+def _to_integer(series):
+
+    if series.isna().any() or not (series % 1 == 0).all():
+        return series
+
+    int32 = np.iinfo('int32')
+    if series.min() >= int32.min and series.max() <= int32.max:
+        return series.astype('int32')
+
+    return series.astype('int64')
+
+
+def apply_schema(df, name):
+
+    """Convert a dataset's columns to the compact dtypes of its schema."""
+
+    schema = SCHEMAS.get(name, {})
+
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+
+        if dtype == 'integer':
+            df[column] = _to_integer(df[column])
+        else:
+            df[column] = df[column].astype(dtype)
+
+    return df
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def read_only(array):
+
+    """Array shared between sessions, protected against modification."""
+
+    array.flags.writeable = False
+
+    return array
@@ -0,0 +1,218 @@
+"""Prepare the datasets as memory-mappable Arrow IPC files.
+
+Run from the app directory, e.g.
+
+    python -m datasets.shared --dest /tmp/covid19-shared
+
+Every dataset is loaded from the bucket as for the app and written
+uncompressed to <dest>/<name>.arrow, with geometries encoded as WKB.
+Server processes started with DATA_SHARED_DIR=<dest> memory-map these
+files read-only instead of fetching and parsing the bucket objects, so
+the workers of `bokeh serve --num-procs N` share one physical copy of
+the tabular datasets. With --interval the bucket is polled and changed
+datasets rewritten, which the workers pick up on their next refresh.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import pyarrow as pa
+
+from datasets.loaders import DATASETS, data_client, load_dataset
+from metrics import span
+
+
+log = logging.getLogger(__name__)
+
+CRS_METADATA_KEY = b'crs'
+
+MANIFEST = 'etags.json'
+
+
+def shared_path(directory, name):
+    return os.path.join(directory, f'{name}.arrow')
+
+
+def file_etag(path):
+    stat = os.stat(path)
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def to_table(df):
+
+    if isinstance(df, gpd.GeoDataFrame):
+        geometry_name = df.geometry.name
+        crs = df.crs.to_json() if df.crs is not None else ''
+
+        table = pa.Table.from_pandas(df.to_wkb(), preserve_index=False)
+
+        metadata = dict(table.schema.metadata or {})
+        metadata[CRS_METADATA_KEY] = json.dumps(
+                                        [geometry_name, crs]).encode()
+
+        return table.replace_schema_metadata(metadata)
+
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_shared(df, path):
+
+    """Write a dataset as an uncompressed Arrow IPC file.
+
+        The file is written alongside and then renamed over the previous
+        one, so processes which mapped the previous file keep a valid
+        mapping until they reload it.
+    """
+
+    table = to_table(df)
+    temp_path = f'{path}.tmp'
+
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    os.replace(temp_path, path)
+
+
+def read_shared(path):
+
+    """Memory-map a dataset written by write_shared.
+
+        Numeric and date columns without missing values are zero-copy,
+        read-only views of the mapped file. Geometries are decoded from
+        WKB, and so are private to each process.
+    """
+
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    df = table.to_pandas(split_blocks=True)
+
+    metadata = table.schema.metadata or {}
+    if CRS_METADATA_KEY in metadata:
+        geometry_name, crs = json.loads(metadata[CRS_METADATA_KEY])
+        df[geometry_name] = gpd.GeoSeries.from_wkb(df[geometry_name])
+        df = gpd.GeoDataFrame(df, geometry=geometry_name, crs=crs or None)
+
+    return df
+
+
+def load_shared(directory, name, etag=None):
+
+    """Conditional load of a prepared dataset, as loaders.load_dataset.
+
+        Returns a (value, etag) tuple, where value is None if the file
+        still matches the given etag.
+    """
+
+    path = shared_path(directory, name)
+    current_etag = file_etag(path)
+
+    if current_etag == etag:
+        return None, etag
+
+    with span('map', dataset=name):
+        return read_shared(path), current_etag
+
+
+def prepare_dataset(client, dest, name, etag):
+
+    """Write a dataset if it changed since etag, returning its new ETag."""
+
+    start = time.perf_counter()
+    path = shared_path(dest, name)
+
+    df, etag = load_dataset(client, name, etag)
+    if df is not None:
+        write_shared(df, path)
+
+        log.info("Wrote shared dataset %s: %.2f MB in %.2fs",
+                 name, os.path.getsize(path) / 1e6,
+                 time.perf_counter() - start)
+
+    return etag
+
+
+def prepare(client, dest, workers=8):
+
+    """Write every dataset which changed in the bucket since last run.
+
+        The bucket ETag of each written dataset is kept in the destination
+        directory, so unchanged datasets are neither fetched nor rewritten
+        and the workers' mappings stay valid. Datasets are loaded and
+        written concurrently, as DataStore refreshes them.
+    """
+
+    manifest_path = os.path.join(dest, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(
+                            prepare_dataset, client, dest, name,
+                            manifest.get(name)
+                            if os.path.exists(shared_path(dest, name))
+                            else None)
+                   for name in DATASETS}
+
+    log.info("Checked %d datasets in %.2fs",
+             len(futures), time.perf_counter() - start)
+
+    # Datasets written before a failure are kept in the manifest
+    failed = []
+    for name, future in futures.items():
+        try:
+            manifest[name] = future.result()
+        except Exception:
+            log.exception("Failed to prepare dataset %s", name)
+            failed.append(name)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    if failed:
+        raise RuntimeError(f"Failed to prepare datasets: {', '.join(failed)}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dest', default=os.getenv('DATA_SHARED_DIR'),
+                        required=not os.getenv('DATA_SHARED_DIR'),
+                        help="directory to write the datasets to "
+                             "(default DATA_SHARED_DIR)")
+    parser.add_argument('--interval', type=float,
+                        help="keep polling the bucket every INTERVAL "
+                             "seconds, rewriting changed datasets")
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('DATA_LOAD_WORKERS', 8)),
+                        help="datasets loaded concurrently")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.dest, exist_ok=True)
+
+    client = data_client()
+
+    # When polling, a failed poll is logged and retried on the next one
+    while True:
+        try:
+            prepare(client, args.dest, args.workers)
+        except Exception:
+            if not args.interval:
+                raise
+            log.exception("Preparing shared datasets failed, retrying in "
+                          "%s seconds", args.interval)
+
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
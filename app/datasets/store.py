@@ -0,0 +1,299 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from datasets.loaders import DATASETS, data_client, load_dataset
+from datasets.shared import load_shared
+
+
+log = logging.getLogger(__name__)
+
+# Values derived from snapshots which were cached already, and which were
+# computed, across every snapshot of the process
+derive_totals = {'hits': 0, 'misses': 0}
+_derive_totals_lock = threading.Lock()
+
+
+def _count_derived(counter):
+    with _derive_totals_lock:
+        derive_totals[counter] += 1
+
+
+class Snapshot:
+
+    """Immutable set of parsed datasets, as published by the data store.
+
+        A session takes one snapshot and builds every tab from it, so it
+        keeps a consistent view while newer snapshots are swapped in.
+    """
+
+    def __init__(self, datasets, etags, loaded_at, derived=None):
+        self._datasets = datasets
+        self._derived = dict(derived or {})
+        self._derived_lock = threading.RLock()
+        self._reading = threading.local()
+        self.etags = etags
+        self.loaded_at = loaded_at
+
+    def __getitem__(self, name):
+        # Datasets read while deriving a value are the ones it depends on
+        reads = getattr(self._reading, 'stack', None)
+        if reads:
+            reads[-1].add(name)
+
+        return self._datasets[name]
+
+    def __contains__(self, name):
+        return name in self._datasets
+
+    def names(self):
+        return list(self._datasets)
+
+    def derive(self, key, compute):
+
+        """Value computed from this snapshot, cached for its lifetime.
+
+            Lets structures derived from the datasets (indexes, pivots)
+            be built once per snapshot rather than once per session, with
+            hits and misses counted in derive_totals.
+
+            - Each value is kept with the ETags of the datasets read while
+              computing it, including through nested derive calls, so it
+              can be carried into the next snapshot (see unchanged).
+        """
+
+        reads = getattr(self._reading, 'stack', None)
+        if reads is None:
+            reads = self._reading.stack = []
+
+        with self._derived_lock:
+            if key in self._derived:
+                _count_derived('hits')
+                value, etags = self._derived[key]
+            else:
+                _count_derived('misses')
+                reads.append(set())
+                try:
+                    value = compute(self)
+                finally:
+                    names = reads.pop()
+
+                etags = {name: self.etags.get(name) for name in names}
+                self._derived[key] = value, etags
+
+            # A value derived from this one depends on the same datasets
+            if reads:
+                reads[-1].update(etags)
+
+            return value
+
+    def unchanged(self, etags):
+
+        """Derived values whose datasets still match the given ETags."""
+
+        with self._derived_lock:
+            return {key: (value, deps)
+                    for key, (value, deps) in self._derived.items()
+                    if all(etag is not None and etags.get(name) == etag
+                           for name, etag in deps.items())}
+
+
+class DataStore:
+
+    """Process-wide cache of the parsed datasets used by the tabs.
+
+        - The first request loads every dataset, later requests are served
+          the in-memory snapshot until its TTL expires.
+
+        - A refresh sends conditional GETs for every dataset concurrently,
+          re-parses only the objects that changed and atomically swaps in
+          a new snapshot.
+          Running the refresh in the background (see DataRefresher) keeps
+          the snapshot fresh without stalling sessions.
+
+        - Cached DataFrames are shared between sessions, so callers
+          must treat them as read-only.
+
+        - Hit, miss and refresh counters are kept for every request.
+
+        - Datasets are loaded with loader(client, name, etag), which
+          returns (None, etag) for datasets that did not change.
+
+        - Values derived from datasets which did not change are carried
+          into the new snapshot, and the warmers added with add_warmer
+          build the others before it is swapped in, so sessions needn't.
+    """
+
+    def __init__(self, datasets, ttl, client_factory=data_client,
+                 workers=8, loader=load_dataset):
+
+        self._datasets = datasets
+        self._ttl = ttl
+        self._workers = workers
+        self._client_factory = client_factory
+        self._loader = loader
+        self._client = None
+        self._snapshot = None
+        self._checked_at = None
+        self._refresh_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._warmers = []
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.not_modified = 0
+
+    def _count(self, counter, n=1):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def add_warmer(self, warm):
+
+        """Call warm(snapshot) on every new snapshot, before swapping it in.
+        """
+
+        self._warmers.append(warm)
+
+    def _warm(self, snapshot):
+
+        if not self._warmers:
+            return
+
+        start = time.perf_counter()
+        for warm in self._warmers:
+            try:
+                warm(snapshot)
+            except Exception:
+                # Sessions derive what failed here on their own
+                log.exception("Failed to warm snapshot with %s", warm)
+
+        log.info("Warmed snapshot in %.2fs", time.perf_counter() - start)
+
+    def _is_fresh(self):
+        return (self._snapshot is not None
+                and time.monotonic() - self._checked_at < self._ttl)
+
+    def _fetch(self, name, etag=None):
+
+        start = time.perf_counter()
+        value, etag = self._loader(self._client, name, etag)
+
+        if value is None:
+            return None, etag
+
+        log.info("Loaded dataset %s in %.2fs",
+                 name, time.perf_counter() - start)
+
+        return value, etag
+
+    def _refresh(self):
+
+        current = self._snapshot
+        datasets = dict(current._datasets) if current else {}
+        etags = dict(current.etags) if current else {}
+        changed = []
+
+        if self._client is None:
+            self._client = self._client_factory()
+
+        # Fetch and parse every dataset concurrently, so loading takes as
+        # long as the slowest dataset rather than the sum of them all
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            futures = {name: executor.submit(self._fetch, name,
+                                             etags.get(name))
+                       for name in self._datasets}
+
+        log.info("Checked %d datasets in %.2fs",
+                 len(futures), time.perf_counter() - start)
+
+        for name, future in futures.items():
+            try:
+                value, etag = future.result()
+            except Exception:
+                if name not in datasets:
+                    raise
+                log.exception("Failed to refresh dataset %s, "
+                              "keeping previous version", name)
+                continue
+
+            if value is None:
+                self._count('not_modified')
+                continue
+
+            datasets[name] = value
+            etags[name] = etag
+            changed.append(name)
+
+        if current is None:
+            self._count('misses')
+        elif changed:
+            self._count('refreshes')
+
+        if changed:
+            snapshot = Snapshot(
+                            datasets, etags, time.time(),
+                            derived=current.unchanged(etags) if current
+                            else None)
+            self._warm(snapshot)
+            self._snapshot = snapshot
+        self._checked_at = time.monotonic()
+
+        return changed
+
+    def refresh(self):
+
+        """Re-fetch datasets that changed and swap in a new snapshot.
+
+            Returns the names of the datasets which were reloaded.
+        """
+
+        with self._refresh_lock:
+            return self._refresh()
+
+    def snapshot(self):
+
+        if not self._is_fresh():
+            # Only one caller loads the data, others wait for its result
+            with self._refresh_lock:
+                if not self._is_fresh():
+                    self._refresh()
+                    return self._snapshot
+
+        self._count('hits')
+
+        return self._snapshot
+
+    def stats(self):
+
+        derived = derive_totals['hits'] + derive_totals['misses']
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'not_modified': self.not_modified,
+                'derive_hits': derive_totals['hits'],
+                'derive_misses': derive_totals['misses'],
+                'derive_hit_rate': (derive_totals['hits'] / derived
+                                    if derived else 0),
+                'snapshot_loaded_at': (self._snapshot.loaded_at
+                                       if self._snapshot else None)}
+
+
+if os.getenv('DATA_SHARED_DIR'):
+    # Memory-map the datasets prepared by datasets.shared, shared between
+    # the processes of a multi-process server
+    data_store = DataStore(
+                    DATASETS,
+                    ttl=float(os.getenv('DATA_STORE_TTL', 3600)),
+                    client_factory=lambda: os.environ['DATA_SHARED_DIR'],
+                    workers=int(os.getenv('DATA_LOAD_WORKERS', 8)),
+                    loader=load_shared)
+else:
+    data_store = DataStore(
+                    DATASETS,
+                    ttl=float(os.getenv('DATA_STORE_TTL', 3600)),
+                    workers=int(os.getenv('DATA_LOAD_WORKERS', 8)))
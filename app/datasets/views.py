@@ -0,0 +1,24 @@
+import math
+import os
+
+import numpy as np
+
+
+# Data views of the country time evolution, in the order of its toggles
+COUNTRY_DATA_VIEWS = ["cases", "deaths", "new_cases", "new_deaths"]
+
+# Data views of the continent summary
+CONTINENT_DATA_VIEWS = ["cases", "new_cases", "deaths", "new_deaths",
+                        "total_vaccinations", "daily_vaccinations"]
+
+# Number of countries ranked per date
+TOP_N = int(os.getenv('TOP_N_COUNTRIES', 11))
+
+
+def bubble_size(values):
+
+    """Vectorised bubble-size mapping, 0.5*log(x, 1.1) for x > 0, else 0."""
+
+    values = np.asarray(values, dtype=float)
+
+    return 0.5 * np.log(np.where(values > 0, values, 1)) / math.log(1.1)
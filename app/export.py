@@ -0,0 +1,100 @@
+"""Export the dashboard as a static site, served without a Bokeh server.
+
+Run from the app directory, e.g.
+
+    python -m export --dest ../site
+
+Renders templates/index.html, with every tab built from the current data
+and its controls driven by CustomJS callbacks, to <dest>/index.html. The
+document JSON is embedded in the page, and the static assets the template
+links to are copied alongside it, so the destination can be served from
+a CDN or any file server. The size of every file in the bundle is
+reported.
+"""
+import argparse
+import os
+import shutil
+import time
+from pathlib import Path
+
+from bokeh.document import Document
+from bokeh.embed import file_html
+from bokeh.io.doc import set_curdoc
+from bokeh.resources import CDN, INLINE
+from bokeh.themes import Theme
+from jinja2 import Environment, FileSystemLoader
+
+from datasets.store import data_store
+from tabs import summary, time_evolution, local_uk
+
+
+APP_DIR = Path(__file__).resolve().parent
+
+RESOURCES = {'cdn': CDN, 'inline': INLINE}
+
+
+def build_document(datasets):
+
+    document = Document()
+    document.theme = Theme(filename=str(APP_DIR / 'theme.yaml'))
+    set_curdoc(document)
+
+    summary.build_summary_tab(datasets, static=True)
+    local_uk.build_local_uk_tab(datasets, static=True)
+    time_evolution.build_time_evolution_tab(datasets, static=True)
+
+    return document
+
+
+def export(dest, resources):
+
+    start = time.perf_counter()
+    document = build_document(data_store.snapshot())
+
+    env = Environment(loader=FileSystemLoader(str(APP_DIR / 'templates')))
+
+    # Server callbacks of the tabs are left out of the page, their
+    # CustomJS counterparts drive it
+    html = file_html(document,
+                     RESOURCES[resources],
+                     title="Covid-19 Dashboard",
+                     template=env.get_template('index.html'),
+                     template_variables=document.template_variables,
+                     suppress_callback_warning=True)
+
+    os.makedirs(dest, exist_ok=True)
+    with open(os.path.join(dest, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(html)
+
+    # Assets are linked relative to the page as app/static/...
+    static_dest = os.path.join(dest, 'app', 'static')
+    shutil.rmtree(static_dest, ignore_errors=True)
+    shutil.copytree(APP_DIR / 'static', static_dest)
+
+    total = 0
+    for root, _, files in os.walk(dest):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            size = os.path.getsize(path)
+            total += size
+            print(f"{os.path.relpath(path, dest)}: {size / 1e6:.2f} MB")
+
+    print(f"Exported {total / 1e6:.2f} MB to {dest} "
+          f"in {time.perf_counter() - start:.2f}s")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dest', required=True,
+                        help="directory to write the site to")
+    parser.add_argument('--resources', choices=list(RESOURCES),
+                        default='cdn',
+                        help="load BokehJS from its CDN, or inline it")
+    args = parser.parse_args()
+
+    export(args.dest, args.resources)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,24 @@
-
 from tabs import summary, time_evolution, local_uk
+from tabs.lazy import add_lazy_tab
+from datasets.store import data_store
 from bokeh.themes import built_in_themes
+import os
+
+# Build every tab from the same snapshot of the data
+datasets = data_store.snapshot()
+
+summary.build_summary_tab(datasets)
 
-summary.build_summary_tab()
-local_uk.build_local_uk_tab()
-time_evolution.build_time_evolution_tab()
+# Tabs other than the summary may be built when first shown
+if os.getenv('LAZY_TABS') == '1':
+    add_lazy_tab(datasets,
+                 local_uk.build_local_uk_tab,
+                 ['local_uk_widgetbox', 'local_uk_geo_plot',
+                  'cases_trend_plot'])
+    add_lazy_tab(datasets,
+                 time_evolution.build_time_evolution_tab,
+                 ['time_evolution_widgetbox', 'time_evolution_geo_plot',
+                  'time_evolution_hbar_plot', 'cases_div', 'deaths_div'])
+else:
+    local_uk.build_local_uk_tab(datasets)
+    time_evolution.build_time_evolution_tab(datasets)
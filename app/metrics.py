@@ -0,0 +1,204 @@
+"""Timing spans, histograms and a Prometheus-style metrics endpoint.
+
+Stages of loading the data and building the tabs, and widget callbacks,
+are timed with span(...) or @timed(...), aggregated per process into
+histograms by span name and labels. MetricsHandler serves them in the
+Prometheus text format, along with the active session count, memory and
+the data store and render counters, every metric labelled with the pid of
+the worker process serving it.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from tornado.web import RequestHandler
+
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+           2.5, 5, 10, float('inf'))
+
+PREFIX = 'covid19'
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Registry:
+
+    """Span histograms and session gauges of the process."""
+
+    def __init__(self):
+
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+        self.sessions = 0
+        self.baseline_rss = None
+
+    def observe(self, name, seconds, labels):
+
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(seconds)
+
+    def session_created(self):
+        with self._lock:
+            self.sessions += 1
+
+    def session_destroyed(self):
+        with self._lock:
+            self.sessions -= 1
+
+    def histograms(self):
+        with self._lock:
+            return {key: (list(histogram.counts), histogram.sum,
+                          histogram.count)
+                    for key, histogram in self._histograms.items()}
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(name, **labels):
+
+    """Time the enclosed block into the span's histogram."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, labels)
+
+
+def timed(name, **labels):
+
+    """Decorator timing every call of a function, e.g. a callback."""
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Stages:
+
+    """Times consecutive stages of a function, e.g. building a tab.
+
+        Each call to done(stage) observes the time since the previous
+        call, or since the Stages was created, as the named stage.
+    """
+
+    def __init__(self, name, **labels):
+        self._name = name
+        self._labels = labels
+        self._start = time.perf_counter()
+
+    def done(self, stage):
+
+        now = time.perf_counter()
+        registry.observe(self._name, now - self._start,
+                         dict(self._labels, stage=stage))
+        self._start = now
+
+
+def rss_bytes():
+
+    """Resident memory of the process, None where it can't be read."""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def _gauges():
+
+    from datasets.store import data_store
+    from tabs.scheduling import render_stats
+
+    gauges = {'active_sessions': registry.sessions}
+
+    rss = rss_bytes()
+    if rss is not None:
+        gauges['resident_memory_bytes'] = rss
+
+        # Memory grown since the data was loaded, shared by the sessions
+        if registry.baseline_rss is not None and registry.sessions:
+            gauges['session_memory_bytes'] = (
+                max(rss - registry.baseline_rss, 0) / registry.sessions)
+
+    for name, stats in [('data_store', data_store.stats()),
+                        ('render', render_stats())]:
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                gauges[f'{name}_{key}'] = value
+
+    return gauges
+
+
+def render():
+
+    """Every metric in the Prometheus text exposition format."""
+
+    # Each worker of a multi-process server answers with its own metrics
+    process = (('pid', os.getpid()),)
+
+    lines = [f'# TYPE {PREFIX}_span_seconds histogram']
+
+    for (name, labels), (counts, total, count) in sorted(
+                                            registry.histograms().items()):
+        labels = process + (('span', name),) + labels
+
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{PREFIX}_span_seconds_bucket'
+                         f'{_labels(labels + (("le", le),))} {cumulative}')
+
+        lines.append(f'{PREFIX}_span_seconds_sum{_labels(labels)} {total}')
+        lines.append(f'{PREFIX}_span_seconds_count{_labels(labels)} {count}')
+
+    for name, value in _gauges().items():
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+        lines.append(f'{PREFIX}_{name}{_labels(process)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(RequestHandler):
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(render())
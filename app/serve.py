@@ -0,0 +1,48 @@
+"""Run bokeh serve, with the process' metrics served at /metrics.
+
+Takes the same arguments as bokeh serve, e.g.
+
+    python app/serve.py --port=5006 --num-procs=2 app
+
+The metrics of whichever worker process answers are served, labelled with
+its pid, see metrics.
+"""
+import argparse
+
+from bokeh.command.subcommands.serve import Serve
+from bokeh.document import Document
+
+from metrics import MetricsHandler, timed
+
+
+class MetricsServe(Serve):
+
+    def invoke(self, args):
+
+        # Session documents are serialised to JSON in reply to the
+        # browser's pull-doc request, once their page has loaded
+        Document.to_json = timed('serialize_document')(Document.to_json)
+
+        return super().invoke(args)
+
+    def customize_kwargs(self, args, server_kwargs):
+
+        server_kwargs = super().customize_kwargs(args, server_kwargs)
+
+        server_kwargs['extra_patterns'] = (
+                        server_kwargs.get('extra_patterns', [])
+                        + [('/metrics', MetricsHandler)])
+
+        return server_kwargs
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    command = MetricsServe(parser=parser)
+
+    command.invoke(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+
+from bokeh.document import Document
+from bokeh.io import curdoc
+from bokeh.io.doc import set_curdoc
+from bokeh.layouts import column
+from bokeh.models import Div
+
+
+@contextmanager
+def models_frozen(document):
+
+    """Walk the document's models once, after the enclosed changes.
+
+        Every change attaching models walks all of the document's models.
+        Deferring the walk relies on Document's private freeze of Bokeh
+        2.3, pinned in requirements.txt; without it each change walks the
+        models as usual.
+    """
+
+    push = getattr(document, '_push_all_models_freeze', None)
+    pop = getattr(document, '_pop_all_models_freeze', None)
+
+    if push is None or pop is None:
+        yield
+        return
+
+    push()
+    try:
+        yield
+    finally:
+        pop()
+
+
+def add_lazy_tab(datasets, build_tab, root_names):
+
+    """Add placeholders for a tab's roots, building it on first activation.
+
+        - A column holding a loading message is added under each of the
+          tab's root names, so the template embeds it as usual.
+
+        - Showing the tab in the browser sets the placeholders' tags (see
+          templates/index.html), which builds the tab into a document of
+          its own, then sets each of its roots as the children of the
+          matching placeholder.
+    """
+
+    document = curdoc()
+
+    placeholders = {name: column(Div(text="Loading..."),
+                                 name=name, tags=['lazy'],
+                                 sizing_mode="scale_width")
+                    for name in root_names}
+
+    def activate(attr, old, new):
+
+        for placeholder in placeholders.values():
+            placeholder.remove_on_change('tags', activate)
+
+        # Adding roots to the session's document walks all of its models,
+        # so the tab is built into a document of its own
+        tab_document = Document()
+        set_curdoc(tab_document)
+        try:
+            build_tab(datasets)
+        finally:
+            set_curdoc(document)
+
+        # Clearing the tab's document detaches its roots in a single walk
+        roots = list(tab_document.roots)
+        tab_document.clear()
+
+        with models_frozen(document):
+            for root in roots:
+                if root.name not in placeholders:
+                    document.add_root(root)
+                    continue
+
+                placeholder = placeholders[root.name]
+                placeholder.name = None
+                placeholder.children = [root]
+
+    for placeholder in placeholders.values():
+        placeholder.on_change('tags', activate)
+        document.add_root(placeholder)
@@ -1,7 +1,8 @@
 from bokeh.io import curdoc
 from bokeh.models import (
-    HoverTool, TapTool, GeoJSONDataSource, ColorBar,
-    ColumnDataSource, Select)
+    HoverTool, TapTool, ColorBar, ColumnDataSource, Select,
+    DateSlider, Button, CustomJS, TextInput)
+from bokeh.layouts import row
 from bokeh.plotting import Figure
 from bokeh.palettes import brewer
 from bokeh.transform import linear_cmap
@@ -9,76 +10,388 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import geopandas as gpd
-import json
 from datetime import timedelta
 import os
-import boto3
+import re
+from pyproj import Transformer
+from shapely.geometry import Point
+from datasets.geometry import simplified, patch_coordinates, spatial_index
+from datasets.schema import read_only
+from metrics import Stages, timed
+from tabs.scheduling import ANIMATION_INTERVAL
+from tabs.sources import binary_array, update_source
+
+
+# Level of detail of the local authority boundaries, see datasets.geometry
+MAP_DETAIL = os.getenv('LA_BOUNDARIES_DETAIL', 'medium')
+
+# Columns plotted or shown in tooltips by the recent trend figure
+TREND_COLUMNS = ['date', 'new_cases', 'weekly_average']
+
+SEARCH_TITLE = "Find a district by name, or lat, lon"
+SEARCH_NOT_FOUND_TITLE = "No district found, try a name, or lat, lon"
+
+# "lat, lon" or "lat lon" in decimal degrees
+COORDINATES = re.compile(
+                r'^\s*([-+]?\d+(?:\.\d*)?)\s*[,\s]\s*([-+]?\d+(?:\.\d*)?)\s*$')
+
+# Static export: colours the map with the slider's date, from the
+# (date x authority) frames flattened row by row
+STATIC_DATE_JS = """
+const dates = dates_cds.data.date
+const frames = frames_cds.data
+const n = geosource.data.lad19cd.length
+
+let i = 0
+while (i + 1 < dates.length && dates[i + 1] <= date_slider.value)
+    i++
+
+geosource.data.new_cases = frames.new_cases.slice(i*n, (i + 1)*n)
+geosource.data.cases_per_pop = frames.cases_per_pop.slice(i*n, (i + 1)*n)
+geosource.change.emit()
+"""
+
+# Static export: shows the trend of the tapped authority, from the rows of
+# every authority's window
+STATIC_TAP_JS = """
+const indices = geosource.selected.indices
+if (indices.length > 0) {
+    const k = indices[0]
+    const start = windows_cds.data.start[k]
+    const end = windows_cds.data.end[k]
+
+    if (end > start) {
+        const trend = cases_trend_cds.data
+        for (const column of Object.keys(trends_cds.data))
+            trend[column] = trends_cds.data[column].slice(start, end)
+        cases_trend_cds.change.emit()
+
+        cases_trend_plot.title.text = "New Cases in "
+                                      + geosource.data.area_name[k]
+    }
+}
+"""
+
+# Static export: selects the first authority matching the search by name,
+# exactly, then by prefix, then anywhere in the name (coordinates need the
+# server's spatial index)
+STATIC_SEARCH_JS = """
+const query = search_input.value.trim().toLowerCase()
+const columns = [geosource.data.lad19nm, geosource.data.area_name]
+const matches = [(name) => name == query,
+                 (name) => name.startsWith(query),
+                 (name) => name.includes(query)]
+
+function find() {
+    for (const match of matches)
+        for (let k = 0; k < columns[0].length; k++)
+            for (const column of columns)
+                if (typeof column[k] == "string"
+                        && match(column[k].toLowerCase()))
+                    return k
+    return -1
+}
+
+const k = query.length > 0 ? find() : -1
+if (k >= 0)
+    geosource.selected.indices = [k]
+search_input.title = k >= 0 || query.length == 0 ? search_title
+                                                  : not_found_title
+"""
+
+# Static export: steps the date slider a day at a time
+STATIC_PLAY_JS = """
+if (play_button.label == "\u25ba Play") {
+    play_button._animation = setInterval(() => {
+        const date = date_slider.value + 24*60*60*1000
+        date_slider.value = date > date_slider.end ? date_slider.start : date
+    }, interval)
+    play_button.label = "\u275a\u275a Pause"
+} else {
+    clearInterval(play_button._animation)
+    play_button.label = "\u25ba Play"
+}
+"""
+
+
+def build_la_map(snapshot, level):
+
+    """Static columns of the local authority map, in boundary order."""
+
+    # Importing simplified local authority boundaries
+    la_boundaries_gdf = simplified(snapshot, 'la_boundaries', level)
+    area_codes = la_boundaries_gdf['lad19cd']
+
+    xs, ys = patch_coordinates(la_boundaries_gdf)
 
+    # Import local authority population data
+    la_pop_df = snapshot['la_populations'].drop_duplicates('code')
+    population = la_pop_df.set_index('code')['population'].reindex(
+                                                                area_codes)
 
-def build_local_uk_tab():
+    # Names used by the uk local authority data
+    la_cases_df = snapshot['local_uk'].drop_duplicates('area_code')
+    area_names = la_cases_df.set_index('area_code')['area_name'].reindex(
+                                                                area_codes)
 
-    s3_storage_options = {
-        'key': os.getenv('AWS_ACCESS_KEY_ID'),
-        'secret': os.getenv('AWS_SECRET_ACCESS_KEY')
-    }
+    return {'xs': xs,
+            'ys': ys,
+            'lad19cd': area_codes.to_numpy(),
+            'lad19nm': la_boundaries_gdf['lad19nm'].to_numpy(),
+            'area_name': area_names.to_numpy(),
+            'population': population.to_numpy('float64')}
 
-    s3_client = boto3.client(
-                    "s3",
-                    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-                    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'))
 
-    s3_root = 's3://covid19-bokeh-app'
+class ChoroplethFrames:
 
-    response = s3_client.get_object(
-                    Bucket='covid19-bokeh-app',
-                    Key="data/_geo_data/la_districts_dec19.zip")
+    """Cases of every local authority on every date, built once per snapshot.
 
-    la_boundaries_gdf = gpd.read_file(
-                            response.get("Body")
-                            ).loc[:, ['lad19cd', 'lad19nm', 'geometry']]
+        Daily cases and weekly cases per 100,000 are held as
+        (date x authority) matrices in map order, with the population join
+        done once, so a date's colours are a row lookup.
+    """
 
-    # Importing uk local authority data
-    la_cases_df = pd.read_csv(
-                    f'{s3_root}/data/local_uk.csv',
-                    storage_options=s3_storage_options)
+    def __init__(self, la_cases_df, area_codes, population):
 
-    # Filter for latest date
-    la_cases_latest_df = la_cases_df.loc[
-                            la_cases_df.date == la_cases_df.date.max()]
+        pivot_df = la_cases_df.pivot(
+                                index='date',
+                                columns='area_code',
+                                values=['new_cases', 'weekly_cases'])
 
-    # Import local authority population data
-    la_pop_df = pd.read_csv(
-                    f'{s3_root}/data/local_authority_populations.csv',
-                    storage_options=s3_storage_options
-                    ).loc[:, ['code', 'population']]
-
-    # Remove commas and convert to numeric dtype
-    la_pop_df['population'] = pd.to_numeric(
-                                    (la_pop_df['population']
-                                        .str.replace(",", "")))
-
-    # Merge cases and population datasets
-    la_cases_latest_df = la_cases_latest_df.merge(
-                                la_pop_df,
-                                left_on="area_code",
-                                right_on="code",
-                                how="left")
-
-    # Merge geo-boundaries GeoDataFrame with cases, pop dataset
-    la_cases_gdf = la_boundaries_gdf.merge(
-                                        la_cases_latest_df,
-                                        left_on="lad19cd",
-                                        right_on="area_code",
-                                        how="left")
-
-    # Calculate weekly cases per 100,000
-    la_cases_gdf['cases_per_pop'] = (100000 * la_cases_gdf['weekly_cases'] /
-                                     la_cases_gdf['population']
-                                     ).fillna(0).astype(int)
-
-    # Convert dataset to GeoJSONDataSource to feed geo-plot
-    geosource = GeoJSONDataSource(
-                    geojson=la_cases_gdf.to_json())
+        self.dates = pivot_df.index.values
+
+        self.new_cases = read_only(pivot_df['new_cases']
+                                   .reindex(columns=area_codes)
+                                   .to_numpy('float64'))
+
+        # Calculate weekly cases per 100,000
+        weekly_cases = (pivot_df['weekly_cases']
+                        .reindex(columns=area_codes)
+                        .to_numpy('float64'))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cases_per_pop = 100000 * weekly_cases / population
+
+        self.cases_per_pop = read_only(
+                                np.where(np.isfinite(cases_per_pop),
+                                         cases_per_pop, 0).astype('int32'))
+
+    def frame(self, date):
+
+        """Colours on the date, or the latest date before it with data.
+
+            Raises KeyError for dates before the first.
+        """
+
+        i = np.searchsorted(self.dates, np.datetime64(date), side='right') - 1
+
+        if i < 0:
+            raise KeyError(f"No local cases on or before {date}")
+
+        return {'new_cases': self.new_cases[i],
+                'cases_per_pop': self.cases_per_pop[i]}
+
+
+class AuthorityTrends:
+
+    """Recent cases trend of every local authority, built once per snapshot.
+
+        Rows are sorted by authority and date, with the slice covering each
+        authority's last 90 days of data kept, so a trend is a lookup.
+        Only the plotted columns are kept, in binary-encoded dtypes, with
+        dates as milliseconds since epoch.
+    """
+
+    def __init__(self, la_cases_df, days=90):
+
+        la_cases_df = la_cases_df.sort_values(
+                                    by=['area_name', 'date'],
+                                    kind='mergesort'
+                                    ).reset_index(drop=True)
+
+        self.columns = {column: read_only(binary_array(
+                                            la_cases_df[column].to_numpy()))
+                        for column in TREND_COLUMNS}
+
+        area_names = la_cases_df['area_name'].to_numpy()
+        dates = la_cases_df['date'].to_numpy()
+
+        starts = np.flatnonzero(
+                    np.append(True, area_names[1:] != area_names[:-1]))
+        ends = np.append(starts[1:], len(area_names))
+
+        self._windows = {}
+        for area_name, start, end in zip(area_names[starts], starts, ends):
+            window_start = np.searchsorted(
+                                dates[start:end],
+                                dates[end - 1] - np.timedelta64(days, 'D'))
+            self._windows[area_name] = (start + window_start, end)
+
+    def __contains__(self, area_name):
+        return area_name in self._windows
+
+    def window(self, area_name):
+
+        """Start and end of an authority's rows, empty if it has none."""
+
+        return self._windows.get(area_name, (0, 0))
+
+    def trend(self, area_name):
+
+        start, end = self._windows[area_name]
+
+        return {column: values[start:end]
+                for column, values in self.columns.items()}
+
+
+class DistrictFinder:
+
+    """Finds the local authority at a point, or by name, once per snapshot.
+
+        - Points are given as latitude and longitude, transformed to the
+          boundaries' coordinate system, and looked up in a spatial index
+          over the full detail boundaries (see datasets.geometry), so only
+          the authorities whose bounding boxes hold the point are tested.
+
+        - Names of the boundaries and of the cases data are matched
+          ignoring case, exactly, then by prefix, then anywhere in the
+          name, taking the first authority in map order.
+
+        Authorities are returned as their row in the map, or None.
+    """
+
+    def __init__(self, la_boundaries_gdf, index, names):
+
+        self._geoms = la_boundaries_gdf.geometry.to_numpy()
+        self._index = index
+
+        crs = la_boundaries_gdf.crs
+        self._transformer = (
+                    Transformer.from_crs('EPSG:4326', crs, always_xy=True)
+                    if crs is not None and not crs.is_geographic else None)
+
+        # Both names of each authority, in map order
+        self._names = [(k, name.casefold())
+                       for k, authority_names in enumerate(zip(*names))
+                       for name in authority_names
+                       if isinstance(name, str)]
+
+        self._exact = {}
+        for k, name in self._names:
+            self._exact.setdefault(name, k)
+
+    def at(self, lat, lon):
+
+        x, y = (self._transformer.transform(lon, lat)
+                if self._transformer is not None else (lon, lat))
+        point = Point(x, y)
+
+        for k in self._index.query(point):
+            if self._geoms[k].covers(point):
+                return int(k)
+
+        return None
+
+    def named(self, query):
+
+        query = query.strip().casefold()
+        if not query:
+            return None
+
+        if query in self._exact:
+            return self._exact[query]
+
+        for match in [str.startswith, str.__contains__]:
+            for k, name in self._names:
+                if match(name, query):
+                    return k
+
+        return None
+
+    def find(self, query):
+
+        """Authority at "lat, lon" coordinates, or else named by query."""
+
+        coordinates = COORDINATES.match(query)
+        if coordinates:
+            lat, lon = (float(value) for value in coordinates.groups())
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return self.at(lat, lon)
+
+        return self.named(query)
+
+
+def authority_map(snapshot):
+
+    """Static columns of the local authority map, once per snapshot."""
+
+    return snapshot.derive(
+                ('la_map', MAP_DETAIL),
+                lambda snapshot: build_la_map(snapshot, MAP_DETAIL))
+
+
+def choropleth_frames(snapshot):
+
+    """Cases of every authority on every date, once per snapshot."""
+
+    def compute(snapshot):
+        la_map = authority_map(snapshot)
+        return ChoroplethFrames(snapshot['local_uk'],
+                                la_map['lad19cd'],
+                                la_map['population'])
+
+    return snapshot.derive(('la_choropleth_frames', MAP_DETAIL), compute)
+
+
+def authority_trends(snapshot):
+
+    """Recent cases of every authority, grouped once per snapshot."""
+
+    return snapshot.derive(
+                'la_cases_trends',
+                lambda snapshot: AuthorityTrends(snapshot['local_uk']))
+
+
+def district_finder(snapshot):
+
+    """Authorities found by name or location, indexed once per snapshot."""
+
+    def compute(snapshot):
+        la_map = authority_map(snapshot)
+        return DistrictFinder(snapshot['la_boundaries'],
+                              spatial_index(snapshot, 'la_boundaries',
+                                            'full'),
+                              [la_map['lad19nm'], la_map['area_name']])
+
+    return snapshot.derive(('la_district_finder', MAP_DETAIL), compute)
+
+
+def warm_local_uk(snapshot):
+
+    """Derive everything the tab builds from, ahead of its sessions."""
+
+    authority_map(snapshot)
+    choropleth_frames(snapshot)
+    authority_trends(snapshot)
+    district_finder(snapshot)
+
+
+@timed('build_tab', tab='local_uk')
+def build_local_uk_tab(datasets, static=False):
+
+    stages = Stages('build_stage', tab='local_uk')
+
+    # Building map geometry and cases on every date once per snapshot
+    la_map = authority_map(datasets)
+    stages.done('la_map')
+
+    frames = choropleth_frames(datasets)
+    stages.done('choropleth_frames')
+
+    # Geometry is sent once, as a plain ColumnDataSource whose cases
+    # columns are updated on date changes
+    latest_date = frames.dates[-1]
+    geosource = ColumnDataSource(dict(la_map, **frames.frame(latest_date)))
 
     # Adding figure and geographical patches from shapefile
     local_uk_geo_plot = Figure(
@@ -92,8 +405,8 @@ def build_local_uk_tab():
     mapper = linear_cmap(
                 field_name='cases_per_pop',
                 palette=brewer['YlOrRd'][9][:7][::-1],
-                low=min(la_cases_gdf['cases_per_pop']),
-                high=max(la_cases_gdf['cases_per_pop']))
+                low=frames.cases_per_pop.min(),
+                high=frames.cases_per_pop.max())
 
     # Add local authority patches to figure
     geo_patches = local_uk_geo_plot.patches(
@@ -118,16 +431,13 @@ def build_local_uk_tab():
                     location=(0, 0))
 
     local_uk_geo_plot.add_layout(color_bar, 'right')
+    stages.done('map_plot')
+
+    # Adding recent trend figure, from trends grouped once per snapshot
+    trends = authority_trends(datasets)
 
-    # Adding recent trend figure
     area_name = "Wandsworth"
-    cases_trend_df = la_cases_df.loc[la_cases_df.area_name == area_name]
-    cases_trend_df.date = pd.to_datetime(cases_trend_df.date,
-                                         format="%Y-%m-%d")
-    ninety_days_back = cases_trend_df.date.max() - timedelta(days=90)
-    cases_trend_df = cases_trend_df.loc[
-                        cases_trend_df.date >= ninety_days_back]
-    cases_trend_cds = ColumnDataSource(cases_trend_df)
+    cases_trend_cds = ColumnDataSource(trends.trend(area_name))
 
     cases_trend_plot = Figure(
             title=f"New Cases in {area_name}",
@@ -155,26 +465,137 @@ def build_local_uk_tab():
                             formatters={"@date": "datetime"})
 
     cases_trend_plot.add_tools(cases_trend_hover)
+    stages.done('trend_plot')
+
+    # Map feature index to authority
+    feature_area_names = la_map['area_name']
 
+    @timed('callback', callback='tap_callback')
     def callback(attr, old, new):
-        index = geosource.selected.indices[0]
-        geojson = json.loads(geosource.geojson)
-        area_name = geojson['features'][index]['properties']['area_name']
 
-        # Adding recent trend figure
-        cases_trend_df = la_cases_df.loc[la_cases_df.area_name == area_name]
-        cases_trend_df.date = pd.to_datetime(cases_trend_df.date,
-                                             format="%Y-%m-%d")
-        ninety_days_back = cases_trend_df.date.max() - timedelta(days=90)
-        cases_trend_df = cases_trend_df.loc[
-                            cases_trend_df.date >= ninety_days_back]
+        if not new:
+            return
 
-        cases_trend_cds.data = cases_trend_df
+        area_name = feature_area_names[new[0]]
+        if area_name not in trends:
+            return
+
+        # Updating recent trend figure
+        update_source(cases_trend_cds, trends.trend(area_name))
 
         cases_trend_plot.title.text = f"New Cases in {area_name}"
 
     geosource.selected.on_change('indices', callback)
 
+    # Finding authorities from the search input, indexed once per snapshot
+    finder = district_finder(datasets)
+
+    @timed('callback', callback='search_callback')
+    def search_callback(attr, old, new):
+
+        k = finder.find(new)
+        if k is None:
+            search_input.title = (SEARCH_NOT_FOUND_TITLE if new.strip()
+                                  else SEARCH_TITLE)
+            return
+
+        search_input.title = SEARCH_TITLE
+
+        # Selecting the authority updates the trend, as tapping it does
+        geosource.selected.indices = [k]
+
+    search_input = TextInput(
+                    title=SEARCH_TITLE,
+                    placeholder="e.g. Wandsworth, or 51.45, -0.19")
+
+    @timed('callback', callback='date_callback')
+    def date_callback(attr, old, new):
+
+        # Only the colour and hover columns are sent
+        geosource.data.update(
+            frames.frame(pd.Timestamp(date_slider.value_as_date)))
+
+    # Adding date slider for the map
+    date_slider = DateSlider(
+                    title="Date",
+                    start=pd.Timestamp(frames.dates[0]),
+                    end=pd.Timestamp(latest_date),
+                    value=pd.Timestamp(latest_date),
+                    sizing_mode="scale_width")
+    date_slider.on_change('value', date_callback)
+
+    # Adding animation with Play/Pause button
+    callback_id = None
+
+    def animate():
+        def animate_update():
+            date = pd.Timestamp(date_slider.value_as_date) + timedelta(days=1)
+            if date > pd.Timestamp(latest_date):
+                date = pd.Timestamp(frames.dates[0])
+            date_slider.value = date
+
+        nonlocal callback_id
+        if play_button.label == '► Play':
+            play_button.label = '❚❚ Pause'
+            callback_id = curdoc().add_periodic_callback(
+                                        animate_update, ANIMATION_INTERVAL)
+        else:
+            play_button.label = '► Play'
+            curdoc().remove_periodic_callback(callback_id)
+
+    play_button = Button(label='► Play', width=60, button_type="success")
+
+    # A static export has no server, so the controls are driven in the
+    # browser from every date's frame and every authority's trend
+    if static:
+        date_slider.js_on_change('value', CustomJS(
+            args={'dates_cds': ColumnDataSource(
+                                {'date': binary_array(frames.dates)}),
+                  'frames_cds': ColumnDataSource({
+                        'new_cases': (frames.new_cases.ravel()
+                                      .astype('float32')),
+                        'cases_per_pop': frames.cases_per_pop.ravel()}),
+                  'geosource': geosource,
+                  'date_slider': date_slider},
+            code=STATIC_DATE_JS))
+
+        windows = np.array([trends.window(area_name)
+                            for area_name in feature_area_names],
+                           dtype='int32').reshape(-1, 2)
+
+        geosource.selected.js_on_change('indices', CustomJS(
+            args={'windows_cds': ColumnDataSource({'start': windows[:, 0],
+                                                   'end': windows[:, 1]}),
+                  'trends_cds': ColumnDataSource(trends.columns),
+                  'geosource': geosource,
+                  'cases_trend_cds': cases_trend_cds,
+                  'cases_trend_plot': cases_trend_plot},
+            code=STATIC_TAP_JS))
+
+        play_button.js_on_click(CustomJS(
+            args={'date_slider': date_slider,
+                  'play_button': play_button,
+                  'interval': ANIMATION_INTERVAL},
+            code=STATIC_PLAY_JS))
+
+        search_input.js_on_change('value', CustomJS(
+            args={'geosource': geosource,
+                  'search_input': search_input,
+                  'search_title': SEARCH_TITLE,
+                  'not_found_title': SEARCH_NOT_FOUND_TITLE},
+            code=STATIC_SEARCH_JS))
+    else:
+        play_button.on_click(animate)
+        search_input.on_change('value', search_callback)
+    stages.done('widgets')
+
+    widgets = row(
+                date_slider, play_button, search_input,
+                name="local_uk_widgetbox",
+                sizing_mode="scale_width")
+
     # Add the plots to the current document
     curdoc().add_root(local_uk_geo_plot)
+    curdoc().add_root(widgets)
     curdoc().add_root(cases_trend_plot)
+    stages.done('layout')
@@ -0,0 +1,132 @@
+import os
+import time
+
+from bokeh.io import curdoc
+
+
+# Play animations either with server callbacks, or in the browser from
+# frames shipped to it once ("client")
+ANIMATION_MODE = os.getenv('ANIMATION_MODE', 'server')
+ANIMATION_INTERVAL = int(os.getenv('ANIMATION_INTERVAL', 300))
+
+# Weight of the latest render in the moving average of render latency
+LATENCY_SMOOTHING = 0.3
+
+# Animation frames are spaced at least this many times the render latency
+INTERVAL_HEADROOM = 1.5
+
+# Counters of every scheduler in the process
+totals = {'requests': 0, 'renders': 0, 'dropped': 0, 'late_frames': 0,
+          'latency_seconds': 0.0}
+
+
+class CoalescingScheduler:
+
+    """Renders the newest requested state of a tab on the next tick.
+
+        - Requests made while a render is pending are coalesced into it,
+          as the render reads the widgets' state when it runs, so only
+          the newest state is rendered and stale updates are dropped.
+
+        - Render latency is measured, and its moving average paces
+          animation frames, so they never queue up behind slow renders.
+
+        - Request, render, dropped update and late frame counters are
+          kept per scheduler and for the whole process.
+    """
+
+    def __init__(self, render):
+
+        self._render = render
+        self._pending = False
+
+        self.requests = 0
+        self.renders = 0
+        self.dropped = 0
+        self.late_frames = 0
+        self.latency = None
+        self.max_latency = 0
+
+    def _count(self, counter, n=1):
+        setattr(self, counter, getattr(self, counter) + n)
+        totals[counter] += n
+
+    def on_change(self, attr, old, new):
+        self.request()
+
+    def request(self):
+
+        """Schedule a render of the newest state on the next tick."""
+
+        self._count('requests')
+
+        if self._pending:
+            self._count('dropped')
+            return
+
+        # The current document is the session's in its callbacks, wherever
+        # the tab was built (see tabs/lazy.py)
+        self._pending = True
+        curdoc().add_next_tick_callback(self._run)
+
+    def _run(self):
+
+        # Already rendered by an animation frame
+        if not self._pending:
+            return
+
+        self._pending = False
+        self.render()
+
+    def render(self):
+
+        start = time.perf_counter()
+        self._render()
+        latency = time.perf_counter() - start
+
+        self._count('renders')
+        totals['latency_seconds'] += latency
+
+        self.latency = (latency if self.latency is None
+                        else LATENCY_SMOOTHING * latency
+                        + (1 - LATENCY_SMOOTHING) * self.latency)
+        self.max_latency = max(self.max_latency, latency)
+
+        return latency
+
+    def render_frame(self, interval):
+
+        """Render an animation frame, returning the delay to the next.
+
+            The delay is the given interval (in ms), stretched to the
+            recent render latency. Frames slower than the interval are
+            counted as late.
+        """
+
+        # A frame also renders any pending request
+        self._pending = False
+
+        latency = self.render()
+        if 1000 * latency > interval:
+            self._count('late_frames')
+
+        return max(interval, 1000 * INTERVAL_HEADROOM * self.latency)
+
+    def stats(self):
+        return {'requests': self.requests,
+                'renders': self.renders,
+                'dropped': self.dropped,
+                'late_frames': self.late_frames,
+                'latency_ms': 1000 * (self.latency or 0),
+                'max_latency_ms': 1000 * self.max_latency}
+
+
+def render_stats():
+
+    """Counters of every scheduler in the process, with mean latency."""
+
+    stats = dict(totals)
+    stats['mean_latency_ms'] = (1000 * stats.pop('latency_seconds')
+                                / max(stats['renders'], 1))
+
+    return stats
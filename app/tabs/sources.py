@@ -0,0 +1,57 @@
+import numpy as np
+
+
+# Dtypes Bokeh sends over the websocket as binary buffers, other arrays
+# are sent as JSON lists
+BINARY_DTYPES = {np.dtype(dtype) for dtype in (
+    'float32', 'float64', 'int8', 'uint8', 'int16', 'uint16',
+    'int32', 'uint32')}
+
+
+def binary_array(values):
+
+    """Numeric array in a dtype Bokeh encodes as binary.
+
+        Integers which fit are held as int32, wider ones as float64.
+    """
+
+    values = np.asarray(values)
+
+    if values.dtype in BINARY_DTYPES:
+        return values
+
+    if values.dtype.kind in 'iub':
+        info = np.iinfo('int32')
+        if values.size == 0 or (values.min() >= info.min
+                                and values.max() <= info.max):
+            return values.astype('int32')
+
+    if values.dtype.kind == 'M':
+        # Datetimes as milliseconds since epoch, as Bokeh would send them
+        return values.astype('datetime64[ns]').astype('int64') / 10**6
+
+    return values.astype('float64')
+
+
+def update_source(source, data):
+
+    """Update a data source, sending only the columns that changed.
+
+        If the new data has the same columns and length as the source's,
+        only the columns whose values differ are replaced, so unchanged
+        columns (e.g. coordinates, names) are not sent to the browser.
+    """
+
+    current = source.data
+
+    if (set(current) != set(data)
+            or any(len(current[column]) != len(values)
+                   for column, values in data.items())):
+        source.data = data
+        return
+
+    changed = {column: values for column, values in data.items()
+               if not np.array_equal(current[column], values)}
+
+    if changed:
+        source.data.update(changed)
@@ -1,5 +1,6 @@
 from bokeh.io import curdoc
-from bokeh.models import ColumnDataSource, HoverTool, HBar
+from bokeh.models import (ColumnDataSource, HoverTool, HBar, Range1d,
+                          CustomJS)
 from bokeh.models.widgets import Tabs, Panel
 from bokeh.plotting import figure
 from bokeh.layouts import widgetbox
@@ -9,108 +10,315 @@ import numpy as np
 from pathlib import Path
 from datetime import datetime, timedelta
 import os
+from datasets.views import CONTINENT_DATA_VIEWS as DATA_VIEWS
+from metrics import Stages, timed
+from tabs.scheduling import CoalescingScheduler
+from tabs.sources import binary_array, update_source
 
 
-def build_summary_tab():
+# Data views of totals to date, whose periods show their last value.
+# Periods of the other, daily, views show their mean per day, so bars keep
+# their scale as the resolution changes.
+CUMULATIVE_VIEWS = ["cases", "deaths", "total_vaccinations"]
 
-    s3_storage_options = {
-      'key': os.getenv('AWS_ACCESS_KEY_ID'),
-      'secret': os.getenv('AWS_SECRET_ACCESS_KEY')
-    }
+# Resolutions of the vbar_stack charts, finest first, with the pandas
+# frequency their days are grouped by and the nominal days per bar
+RESOLUTIONS = [
+    ("daily", None, 1),
+    ("weekly", "W-MON", 7),
+    ("monthly", "MS", 30.4)]
 
-    s3_root = 's3://covid19-bokeh-app'
+# Bars are kept at least this many pixels wide, by switching to a coarser
+# resolution as the charts zoom out
+MIN_BAR_PIXELS = int(os.getenv('MIN_BAR_PIXELS', 4))
 
-    # Import global by day dataset
-    global_by_day_df = pd.read_csv(
-                              f'{s3_root}/data/global_by_day.csv',
-                              storage_options=s3_storage_options)
+# Width of the plotting area assumed by the server, which isn't told the
+# width the charts are laid out at (the static export reads it instead)
+ASSUMED_PLOT_WIDTH = 1000
 
-    global_by_day_df.date = pd.to_datetime(global_by_day_df.date)
+DAY_MS = 24 * 3600 * 1000
 
-    latest_cases_date = global_by_day_df.loc[
-                            ~global_by_day_df.cases.isna()
-                            ].date.max()
+# Static export: swaps the bars of the resolution the range's width calls
+# for into the chart's data source
+STATIC_RESOLUTION_JS = """
+const days_shown = (fig.x_range.end - fig.x_range.start)/(24*3600*1000)
+const pixels = fig.inner_width > 0 ? fig.inner_width : assumed_width
 
-    latest_cases_values = global_by_day_df.loc[
-                        global_by_day_df.date == latest_cases_date]
+let i = 0
+while (i + 1 < days.length && days_shown/days[i]*min_bar_pixels > pixels)
+    i++
 
-    latest_vaccinations_date = global_by_day_df.loc[
-                                    ~global_by_day_df.total_vaccinations.isna()
-                                    ].date.max()
+if (source.data !== sources[i].data)
+    source.data = sources[i].data
+"""
 
-    latest_vaccinations_values = global_by_day_df.loc[
-                        global_by_day_df.date == latest_vaccinations_date]
 
-    global_cases = latest_cases_values.cases.values[0]
-    global_deaths = latest_cases_values.deaths.values[0]
-    new_cases = latest_cases_values.new_cases.values[0]
-    new_deaths = latest_cases_values.new_deaths.values[0]
+def to_ms(value):
 
-    global_vaccinations = (latest_vaccinations_values
-                           .total_vaccinations.values[0])
-    new_vaccinations = (latest_vaccinations_values
-                        .daily_vaccinations.values[0])
-    global_percentage_vaccinated = (latest_vaccinations_values
-                                    .people_vaccinated_per_hundred.values[0])
-    global_percentage_fully_vaccinated = (latest_vaccinations_values
-                                          .people_fully_vaccinated_per_hundred
-                                          .values[0])
+    # Ranges hold datetimes until the browser updates them
+    if isinstance(value, (int, float)):
+        return value
+    return pd.Timestamp(value).value / 10**6
 
-    curdoc().template_variables['summary'] = {
-                "global_cases": f"{int(global_cases):,}",
-                "new_cases": f"{int(new_cases):,}",
-                "global_deaths": f"{int(global_deaths):,}",
-                "new_deaths": f"{int(new_deaths):,}",
-                "latest_cases_date": latest_cases_date.strftime("%d/%m/%Y"),
-                "global_vaccinations": f"{int(global_vaccinations):,}",
-                "new_vaccinations": f"{int(new_vaccinations):,}",
-                "latest_vaccinations_date": latest_vaccinations_date.strftime("%d/%m/%Y")}
 
-    # Import continents by day dataset
-    continents_by_day_df = pd.read_csv(
-                              f'{s3_root}/data/continents_by_day.csv',
-                              storage_options=s3_storage_options)
+class ContinentHistory:
 
-    continents_by_day_df.date = pd.to_datetime(continents_by_day_df.date,
-                                               format='%Y-%m-%d')
+    """Continent pivots of every data view, at every resolution.
 
-    # Adding vaccinations tabs
-    vaccinations_by_continent_df = pd.read_csv(
-                                        f'{s3_root}/data/vaccinations_by_continent_by_day.csv',
-                                        storage_options=s3_storage_options)
+        - Daily values of all the data views are pivoted in one pass, to
+          a column per data view and continent, and aggregated into weekly
+          and monthly periods along with their totals.
 
-    vaccinations_by_continent_df.date = pd.to_datetime(
-                                            vaccinations_by_continent_df.date,
-                                            format='%Y-%m-%d')
+        - Each period's bar is centred on the days it covers, half a
+          period wide, with the period's first date for tooltips.
 
-    merged_continents_df = continents_by_day_df.merge(
-                                vaccinations_by_continent_df,
-                                how='outer', on=['date', 'continent'],
-                                validate='one_to_one')
+        - bars() returns the columns of a data view's bars within a window
+          of dates, for the vbar_stack data sources.
+    """
 
-    # Daily cases/deaths plots
-    panel_dict = {}
-    data_views = ["cases", "new_cases", "deaths", "new_deaths",
-                  "total_vaccinations", "daily_vaccinations"]
+    def __init__(self, continents_by_day_df, vaccinations_by_continent_df):
+
+        merged_continents_df = continents_by_day_df.merge(
+                                    vaccinations_by_continent_df,
+                                    how='outer', on=['date', 'continent'],
+                                    validate='one_to_one')
 
-    for data_view in data_views:
+        self.start = to_ms(merged_continents_df.date.min()) - DAY_MS
+        self.end = to_ms(merged_continents_df.date.max()) + DAY_MS
 
+        # Every data view pivoted at once, to a (data view, continent)
+        # column per pair
         continents_pivot_df = merged_continents_df.pivot(
-                                                    index='date',
-                                                    columns='continent',
-                                                    values=data_view)
+                                                index='date',
+                                                columns='continent',
+                                                values=DATA_VIEWS)
+
+        self.continent_names = list(
+                        continents_pivot_df.columns.unique(level='continent'))
+        continents_pivot_df = continents_pivot_df.reindex(
+                        columns=pd.MultiIndex.from_product(
+                                    [DATA_VIEWS, self.continent_names]))
+
+        self.periods = {}
+        for resolution, freq, _ in RESOLUTIONS:
+            self.periods.update(
+                    {(data_view, resolution): columns
+                     for data_view, columns in self._aggregate(
+                                        continents_pivot_df, freq).items()})
+
+    def _aggregate(self, continents_pivot_df, freq):
+
+        if freq is None:
+            periods_df = continents_pivot_df
+            ends = periods_df.index + pd.Timedelta(days=1)
+        else:
+            # Cumulative views take each period's last value, the daily
+            # views its mean, each in one pass over all their columns
+            cumulative = continents_pivot_df.columns.get_level_values(
+                                                    0).isin(CUMULATIVE_VIEWS)
+            periods_df = pd.concat(
+                    [continents_pivot_df.loc[:, cumulative].resample(
+                            freq, label='left', closed='left').last(),
+                     continents_pivot_df.loc[:, ~cumulative].resample(
+                            freq, label='left', closed='left').mean()],
+                    axis=1)[continents_pivot_df.columns]
+            ends = periods_df.index + pd.tseries.frequencies.to_offset(freq)
+
+        # Totals of every data view at once, over the continent axis
+        totals = np.nansum(
+                    periods_df.to_numpy(dtype=float).reshape(
+                                len(periods_df), len(DATA_VIEWS),
+                                len(self.continent_names)),
+                    axis=2)
+
+        period_ms = (ends - periods_df.index).total_seconds() * 1000
+
+        # Date columns are shared by the data views of a resolution
+        dates = binary_array(periods_df.index.values)
+        x = dates + (period_ms.values - DAY_MS) / 2
+        width = 0.5 * period_ms.values
+
+        views = {}
+        for i, data_view in enumerate(DATA_VIEWS):
+            columns = {'date': dates, 'x': x, 'width': width}
+            for continent in self.continent_names:
+                columns[continent] = binary_array(
+                                periods_df[data_view, continent].values)
+            total = totals[:, i]
+            if all(pd.api.types.is_integer_dtype(dtype)
+                   for dtype in periods_df[data_view].dtypes):
+                total = total.astype(np.int64)
+            columns['total'] = binary_array(total)
+            views[data_view] = columns
+
+        return views
+
+    def resolution(self, start, end, pixels=ASSUMED_PLOT_WIDTH):
+
+        """Finest resolution whose bars are MIN_BAR_PIXELS wide or more."""
+
+        days = (to_ms(end) - to_ms(start)) / DAY_MS
+
+        for resolution, _, days_per_bar in RESOLUTIONS:
+            if days / days_per_bar * MIN_BAR_PIXELS <= pixels:
+                return resolution
+
+        return RESOLUTIONS[-1][0]
+
+    def bars(self, data_view, resolution, start=None, end=None):
+
+        columns = self.periods[data_view, resolution]
+
+        if start is None and end is None:
+            return columns
+
+        first, last = np.searchsorted(columns['x'], [to_ms(start),
+                                                     to_ms(end)])
+
+        # Bars straddling the window's edges are kept
+        window = slice(max(first - 1, 0), last + 1)
+
+        return {column: values[window] for column, values in columns.items()}
+
+
+def switch_resolution_on_zoom(fig, source, history, data_view):
+
+    """Load the bars of the resolution the figure's x range calls for.
+
+        - As the range changes, the finest resolution whose bars are at
+          least MIN_BAR_PIXELS wide is loaded, with bars in a window three
+          times as wide as the range, centred on it.
+
+        - Range changes within the loaded window, at the same resolution,
+          don't send any data, and changes made before the next tick (as
+          both ends of the range change) are coalesced into one update.
+
+        - The source starts with every bar of the resolution of the
+          figure's initial range.
+    """
+
+    loaded = {'resolution': history.resolution(fig.x_range.start,
+                                               fig.x_range.end),
+              'start': -np.inf,
+              'end': np.inf}
+
+    def update_bars():
+
+        start = to_ms(fig.x_range.start)
+        end = to_ms(fig.x_range.end)
+        resolution = history.resolution(start, end)
+
+        if (resolution == loaded['resolution']
+                and loaded['start'] <= start and end <= loaded['end']):
+            return
 
-        continent_names = list(continents_pivot_df.columns)
+        span = end - start
+        loaded.update(resolution=resolution,
+                      start=start - span,
+                      end=end + span)
 
-        continents_pivot_df['total'] = continents_pivot_df.sum(axis=1)
+        update_source(source, history.bars(data_view, resolution,
+                                           loaded['start'], loaded['end']))
 
-        continents_by_day_cds = ColumnDataSource(continents_pivot_df)
+    scheduler = CoalescingScheduler(update_bars)
+
+    fig.x_range.on_change('start', scheduler.on_change)
+    fig.x_range.on_change('end', scheduler.on_change)
+
+
+def headline(global_by_day_df):
+
+    """Latest global cases and vaccinations, formatted for the template.
+
+        - The latest date of each is the last with a value, as the
+          vaccinations are reported later than the cases.
+    """
+
+    by_date_df = global_by_day_df.set_index('date').sort_index()
+
+    latest_cases_date = by_date_df.cases.last_valid_index()
+    latest_vaccinations_date = (by_date_df.total_vaccinations
+                                .last_valid_index())
+
+    latest_cases_values = by_date_df.loc[latest_cases_date]
+    latest_vaccinations_values = by_date_df.loc[latest_vaccinations_date]
+
+    return {
+        "global_cases": f"{int(latest_cases_values.cases):,}",
+        "new_cases": f"{int(latest_cases_values.new_cases):,}",
+        "global_deaths": f"{int(latest_cases_values.deaths):,}",
+        "new_deaths": f"{int(latest_cases_values.new_deaths):,}",
+        "latest_cases_date": latest_cases_date.strftime("%d/%m/%Y"),
+        "global_vaccinations": (
+            f"{int(latest_vaccinations_values.total_vaccinations):,}"),
+        "new_vaccinations": (
+            f"{int(latest_vaccinations_values.daily_vaccinations):,}"),
+        "latest_vaccinations_date": (
+            latest_vaccinations_date.strftime("%d/%m/%Y"))}
+
+
+def summary_headline(snapshot):
+
+    """Latest global figures, found once per snapshot."""
+
+    return snapshot.derive(
+                'summary_headline',
+                lambda snapshot: headline(snapshot['global_by_day']))
+
+
+def continent_history(snapshot):
+
+    """Continents by day, pivoted and aggregated once per snapshot."""
+
+    return snapshot.derive(
+                'continent_history',
+                lambda snapshot: ContinentHistory(
+                                    snapshot['continents_by_day'],
+                                    snapshot['vaccinations_by_continent']))
+
+
+def warm_summary(snapshot):
+
+    """Derive everything the tab builds from, ahead of its sessions."""
+
+    summary_headline(snapshot)
+    continent_history(snapshot)
+
+
+@timed('build_tab', tab='summary')
+def build_summary_tab(datasets, static=False):
+
+    stages = Stages('build_stage', tab='summary')
+
+    # Latest global figures, found once per snapshot
+    curdoc().template_variables['summary'] = dict(
+                                                summary_headline(datasets))
+    stages.done('headline')
+
+    # Continents by day, with vaccinations, pivoted and aggregated at
+    # every resolution once per snapshot
+    history = continent_history(datasets)
+    continent_names = history.continent_names
+    stages.done('history')
+
+    # Daily cases/deaths plots
+    panel_dict = {}
+
+    for data_view in DATA_VIEWS:
+
+        # Bars are loaded at the resolution of the range shown
+        continents_by_day_cds = ColumnDataSource(
+                                    history.bars(
+                                        data_view,
+                                        history.resolution(history.start,
+                                                           history.end)))
 
         # Creating figure
         fig = figure(
                 name=f"{data_view}_vbar",
                 sizing_mode="scale_width",
                 x_axis_type="datetime",
+                x_range=Range1d(history.start, history.end, bounds='auto'),
                 plot_height=200)
 
         colors = [Spectral11[i] for i in range(len(continent_names))]
@@ -118,8 +326,8 @@ def build_summary_tab():
         # Adding vbar for data view
         vbar = fig.vbar_stack(
                     continent_names,
-                    x="date",
-                    width=timedelta(days=0.5),
+                    x="x",
+                    width="width",
                     color=colors,
                     legend_label=continent_names,
                     source=continents_by_day_cds)
@@ -139,9 +347,29 @@ def build_summary_tab():
 
         fig.add_tools(hover)
 
+        # A static export has no server, so the bars of every resolution
+        # are embedded, and swapped in the browser
+        if static:
+            switch_resolution = CustomJS(
+                args={'fig': fig,
+                      'source': continents_by_day_cds,
+                      'sources': [ColumnDataSource(
+                                    history.bars(data_view, resolution))
+                                  for resolution, _, _ in RESOLUTIONS],
+                      'days': [days for _, _, days in RESOLUTIONS],
+                      'min_bar_pixels': MIN_BAR_PIXELS,
+                      'assumed_width': ASSUMED_PLOT_WIDTH},
+                code=STATIC_RESOLUTION_JS)
+            fig.x_range.js_on_change('start', switch_resolution)
+            fig.x_range.js_on_change('end', switch_resolution)
+        else:
+            switch_resolution_on_zoom(
+                fig, continents_by_day_cds, history, data_view)
+
         # Creating panel for plot, filling panel dict
         panel = Panel(child=fig, title=data_view)
         panel_dict[data_view] = panel
+        stages.done('figure')
 
     # Creating tab layouts and adding to root
     cases_tabs = Tabs(
@@ -161,3 +389,4 @@ def build_summary_tab():
                           panel_dict["daily_vaccinations"]],
                     name="daily_vaccinations_tabs")
     curdoc().add_root(vaccinations_tabs)
+    stages.done('layout')
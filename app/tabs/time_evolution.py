@@ -1,71 +1,428 @@
 from bokeh.io import curdoc
 from bokeh.models import (ColumnDataSource, HoverTool, Button,
                           GeoJSONDataSource, DateSlider, RadioButtonGroup,
-                          Div, LabelSet, RadioGroup)
+                          Div, LabelSet, RadioGroup, CustomJS, CDSView,
+                          IndexFilter)
+from bokeh.core.property.validation import validate
 from bokeh.plotting import figure
 from bokeh.layouts import widgetbox, column
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import geopandas as gpd
-import math
 from datetime import datetime, timedelta
 import os
-import boto3
+from datasets.geometry import (EMPTY_GEOJSON, geojson, simplified,
+                               viewport_detail)
+from datasets.schema import read_only
+from datasets.views import COUNTRY_DATA_VIEWS as DATA_VIEWS
+from datasets.views import TOP_N, bubble_size
+from metrics import Stages, timed
+from tabs.scheduling import (ANIMATION_INTERVAL, ANIMATION_MODE,
+                             CoalescingScheduler)
+from tabs.sources import binary_array, update_source
+
+
+# Columns of a date's rows referenced by the bubbles and their tooltips,
+# besides the size and value of the selected data view
+FRAME_COLUMNS = ["long", "lat", "region", "province"]
+
+# Level of detail of the world land outlines, see datasets.geometry
+MAP_DETAIL = os.getenv('WORLD_LAND_DETAIL', 'low')
+
+# Level of detail of the 1:10m land within a continent's ranges, once
+# zoomed in, drawn over the 1:50m world land outlines elsewhere
+ZOOM_DETAIL = os.getenv('CONTINENT_LAND_DETAIL', 'high')
+
+# Renders frames from DateIndex.animation_frames into the data sources in
+# place, so no data is synced back to the server
+CLIENT_RENDER_JS = """
+const VIEWS = ["cases", "deaths", "new_cases", "new_deaths"]
+const dates = dates_cds.data
+const rows = frames_cds.data
+const ranks = rankings_cds.data
+
+function decode(codes, names, start, end) {
+    const values = new Array(end - start)
+    for (let j = start; j < end; j++)
+        values[j - start] = codes[j] < 0 ? NaN : names[codes[j]]
+    return values
+}
+
+function render(i) {
+    const view = VIEWS[cases_deaths_button.active
+                       + 2*total_new_button.active]
+
+    const start = dates.start[i]
+    const end = dates.end[i]
+    const cases = cases_cds.data
+    for (const key of Object.keys(cases))
+        delete cases[key]
+    cases.long = rows.long.slice(start, end)
+    cases.lat = rows.lat.slice(start, end)
+    cases.size = rows["size_" + view].slice(start, end)
+    cases.region = decode(rows.region, regions, start, end)
+    cases.province = decode(rows.province, provinces, start, end)
+    cases.value = rows[view].slice(start, end)
+    cases_cds.change.emit()
+
+    const rank_start = dates["rank_start_" + view][i]
+    const rank_end = dates["rank_end_" + view][i]
+    const countries = countries_cds.data
+    countries.index = Array.from({length: rank_end - rank_start}, (_, j) => j)
+    countries.region = decode(ranks["region_" + view], regions,
+                              rank_start, rank_end)
+    countries.value = ranks["value_" + view].slice(rank_start, rank_end)
+    countries_cds.change.emit()
+
+    if (rank_end > rank_start)
+        hbar_plot.x_range.end = countries.value[0]*1.2
+    cases_div.text = '<h3 class="card-text">'
+                     + dates.global_cases[i].toLocaleString("en") + '</h3>'
+    deaths_div.text = '<h3 class="card-text">'
+                      + dates.global_deaths[i].toLocaleString("en") + '</h3>'
+    date_slider.value = dates.date[i]
+}
+"""
+
+# Client-side animation
+CLIENT_ANIMATION_JS = CLIENT_RENDER_JS + """
+if (play_button.label == "\u25ba Play") {
+    const animation = {frames: 0, started: performance.now()}
+    let i = Math.max(dates.date.indexOf(date_slider.value), 0)
+
+    animation.id = setInterval(() => {
+        i = i + 1 >= dates.date.length ? 0 : i + 1
+        render(i)
+        animation.frames++
+    }, interval)
+
+    play_button._animation = animation
+    play_button.label = "\u275a\u275a Pause"
+} else {
+    const animation = play_button._animation
+    clearInterval(animation.id)
+
+    const seconds = (performance.now() - animation.started) / 1000
+    console.log("Client-side animation: "
+                + (animation.frames / seconds).toFixed(1) + " fps")
+
+    play_button.label = "\u25ba Play"
+}
+"""
+
+# Static export: renders the frame of the slider's date and data view
+CLIENT_UPDATE_JS = CLIENT_RENDER_JS + """
+if (play_button.label == "\u25ba Play") {
+    let i = 0
+    while (i + 1 < dates.date.length && dates.date[i + 1] <= date_slider.value)
+        i++
+    render(i)
+
+    const label = cases_deaths_button.labels[cases_deaths_button.active]
+    const title = (total_new_button.active == 1 ? "New " : "") + label
+    hover.tooltips = [["Country/Region", "@region"],
+                      ["Province/State", "@province"],
+                      [title, "@value"]]
+    hover_hbar.tooltips = [["Country/Region", "@region"], [title, "@value"]]
+}
+"""
+
+# Map ranges of each continent toggle, worldwide first
+CONTINENT_RANGES = [
+    # Worldwide
+    {'x_range': [-200, 200],
+     'y_range': [-100, 100]},
+    # Europe
+    {'x_range': [-30, 50],
+     'y_range': [30, 70]},
+    # North America
+    {'x_range': [-175, -15],
+     'y_range': [0, 80]},
+    # South America
+    {'x_range': [-140, 10],
+     'y_range': [-60, 15]},
+    # Africa
+    {'x_range': [-55, 105],
+     'y_range': [-40, 40]},
+    # Asia
+    {'x_range': [40, 140],
+     'y_range': [-5, 45]},
+    # Oceania
+    {'x_range': [80, 200],
+     'y_range': [-55, 5]}]
+
+RECOMPUTE_VIEW_JS = """
+view.compute_indices()
+"""
+
+# Static export: zooms the ranges, keeping the world land outlines
+CONTINENT_ZOOM_JS = """
+const map_ref = continent_ranges[continent_button.active]
+geo_plot.x_range.start = map_ref.x_range[0]
+geo_plot.x_range.end = map_ref.x_range[1]
+geo_plot.y_range.start = map_ref.y_range[0]
+geo_plot.y_range.end = map_ref.y_range[1]
+"""
+
+
+class DateIndex:
+
+    """Geo time evolution rows grouped by date, built once per snapshot.
+
+        - Rows are sorted by date, with offsets marking where each date's
+          rows start, so selecting a date is a slice of each column.
+
+        - Bubble sizes are precomputed for every data view.
+
+        - Country totals are ranked per date and data view, keeping the
+          top N countries for the hbar plot.
+
+        - Global totals are indexed by date.
+    """
+
+    def __init__(self, time_evol_df, global_by_day_df, top_n=TOP_N):
+
+        time_evol_df = time_evol_df.sort_values(
+                                        by='date', kind='mergesort'
+                                        ).reset_index(drop=True)
+
+        date_values = time_evol_df.date.values
+        self.dates = np.unique(date_values)
+        self._offsets = np.append(
+                            np.searchsorted(date_values, self.dates),
+                            len(time_evol_df))
+
+        self.columns = {column: read_only(time_evol_df[column].to_numpy())
+                        for column in time_evol_df.columns}
+
+        # Numeric columns sent to the browser in binary-encoded dtypes
+        for column in ['long', 'lat']:
+            self.columns[column] = read_only(
+                                    self.columns[column].astype('float32'))
+        for data_view in DATA_VIEWS:
+            self.columns[data_view] = read_only(
+                                        binary_array(self.columns[data_view]))
+
+        self.sizes = {data_view: read_only(
+                                    bubble_size(self.columns[data_view])
+                                    .astype('float32'))
+                      for data_view in DATA_VIEWS}
+
+        # Summing provinces into countries, then ranking each data view
+        countries_df = time_evol_df.groupby(
+                                    ['date', 'region'], observed=True
+                                    )[DATA_VIEWS].sum().reset_index()
+
+        self.rankings = {}
+        for data_view in DATA_VIEWS:
+            ranked_df = countries_df.sort_values(
+                                        by=['date', data_view],
+                                        ascending=[True, False],
+                                        kind='mergesort')
+            ranked_df = ranked_df.loc[
+                            ranked_df.groupby('date').cumcount() < top_n]
+
+            offsets = np.append(
+                        np.searchsorted(ranked_df.date.values, self.dates),
+                        len(ranked_df))
+
+            self.rankings[data_view] = (
+                                offsets,
+                                read_only(ranked_df.region.to_numpy()),
+                                read_only(binary_array(
+                                            ranked_df[data_view].to_numpy())))
+
+        self.global_totals = (global_by_day_df
+                              .set_index('date')
+                              .loc[:, ['cases', 'deaths']])
+
+    def _position(self, date):
+
+        date = np.datetime64(pd.Timestamp(date))
+        i = np.searchsorted(self.dates, date)
+
+        if i == len(self.dates) or self.dates[i] != date:
+            return None
 
+        return i
 
-def build_time_evolution_tab():
+    def frame(self, date, data_view):
 
-    s3_storage_options = {
-      'key': os.getenv('AWS_ACCESS_KEY_ID'),
-      'secret': os.getenv('AWS_SECRET_ACCESS_KEY')
-    }
+        """Column data of every row on the given date.
 
-    s3_client = boto3.client(
-                    "s3",
-                    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-                    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'))
+            Only the columns plotted or shown in tooltips are included,
+            with the selected data view as 'value'.
+        """
+
+        i = self._position(date)
+        start, end = ((self._offsets[i], self._offsets[i + 1])
+                      if i is not None else (0, 0))
+
+        data = {column: self.columns[column][start:end]
+                for column in FRAME_COLUMNS}
+        data['size'] = self.sizes[data_view][start:end]
+        data['value'] = self.columns[data_view][start:end]
+
+        return data
+
+    def ranking(self, date, data_view):
+
+        """Top countries on the given date, with the hbar x-range end."""
+
+        offsets, regions, values = self.rankings[data_view]
+
+        i = self._position(date)
+        start, end = ((offsets[i], offsets[i + 1])
+                      if i is not None else (0, 0))
+
+        data = {'index': np.arange(end - start, dtype='int32'),
+                'region': regions[start:end],
+                'value': values[start:end]}
+        x_end = float(values[start])*1.2 if end > start else 1
+
+        return data, x_end
+
+    def animation_frames(self):
+
+        """Compact encoding of every date's frame, for client animation.
+
+            Returns column data for the per-date offsets and totals, the
+            bubble rows and the ranking rows, with strings encoded as codes
+            into the returned region and province names (-1 for missing).
+        """
+
+        region_codes, regions = pd.factorize(self.columns['region'])
+        province_codes, provinces = pd.factorize(self.columns['province'])
+
+        dates = {
+            'date': (pd.DatetimeIndex(self.dates).asi8 // 10**6
+                     ).astype('float64'),
+            'start': self._offsets[:-1].astype('int32'),
+            'end': self._offsets[1:].astype('int32')}
+
+        totals = self.global_totals.reindex(self.dates)
+        dates['global_cases'] = totals['cases'].fillna(0).to_numpy('float64')
+        dates['global_deaths'] = (totals['deaths'].fillna(0)
+                                  .to_numpy('float64'))
+
+        rows = {'long': self.columns['long'].astype('float32'),
+                'lat': self.columns['lat'].astype('float32'),
+                'region': region_codes.astype('int32'),
+                'province': province_codes.astype('int32')}
+
+        for data_view in DATA_VIEWS:
+            rows[data_view] = self.columns[data_view].astype('float64')
+            rows[f'size_{data_view}'] = (self.sizes[data_view]
+                                         .astype('float32'))
+
+        ranks = {}
+        for data_view in DATA_VIEWS:
+            # Views may rank a different number of countries on a date
+            offsets, ranked_regions, values = self.rankings[data_view]
+            dates[f'rank_start_{data_view}'] = offsets[:-1].astype('int32')
+            dates[f'rank_end_{data_view}'] = offsets[1:].astype('int32')
+            ranks[f'region_{data_view}'] = (pd.Index(regions)
+                                            .get_indexer(ranked_regions)
+                                            .astype('int32'))
+            ranks[f'value_{data_view}'] = values.astype('float64')
+
+        return {'dates': dates,
+                'rows': rows,
+                'ranks': ranks,
+                'regions': list(regions),
+                'provinces': list(provinces)}
+
+    def totals(self, date):
+
+        totals = self.global_totals.loc[pd.Timestamp(date)]
+
+        return int(totals['cases']), int(totals['deaths'])
+
+
+def evolution_index(snapshot):
+
+    """Cases/deaths of every region, indexed by date once per snapshot."""
+
+    return snapshot.derive(
+                'time_evolution_date_index',
+                lambda snapshot: DateIndex(snapshot['geo_time_evolution'],
+                                           snapshot['global_by_day']))
+
+
+def animation_frames(snapshot):
+
+    """Columns of every frame animated in the browser, once per snapshot."""
+
+    return snapshot.derive(
+                'time_evolution_animation_frames',
+                lambda snapshot: evolution_index(snapshot).animation_frames())
+
+
+def continent_detail(snapshot, map_ref):
+
+    """Detailed land within a continent's ranges, clipped once per snapshot.
+    """
+
+    return viewport_detail(snapshot,
+                           (map_ref['x_range'][0], map_ref['y_range'][0],
+                            map_ref['x_range'][1], map_ref['y_range'][1]),
+                           ('world_land_detailed', ZOOM_DETAIL),
+                           ('world_land', MAP_DETAIL))
+
+
+def warm_time_evolution(snapshot):
+
+    """Derive everything the tab builds from, ahead of its sessions."""
 
-    # Importing geographical shapefile
-    s3_root = 's3://covid19-bokeh-app'
+    geojson(snapshot, 'world_land', MAP_DETAIL)
+    evolution_index(snapshot)
 
-    response = s3_client.get_object(
-                Bucket='covid19-bokeh-app',
-                Key="data/_geo_data/ne_50m_land.zip")
+    if ANIMATION_MODE == 'client':
+        animation_frames(snapshot)
 
-    geo_data_gdf = gpd.read_file(response.get("Body"))
+    for map_ref in CONTINENT_RANGES[1:]:
+        continent_detail(snapshot, map_ref)
 
-    geosource = GeoJSONDataSource(geojson=geo_data_gdf.to_json())
 
-    # Importing geo-evolutions cases/deaths data
-    time_evol_df = pd.read_csv(
-                        f'{s3_root}/data/geo_time_evolution.csv',
-                        storage_options=s3_storage_options)
+@timed('build_tab', tab='time_evolution')
+def build_time_evolution_tab(datasets, static=False):
 
-    # Selecting earliest snapshot
-    time_evol_df.date = pd.to_datetime(time_evol_df.date, format="%Y-%m-%d")
+    stages = Stages('build_stage', tab='time_evolution')
 
-    snapshot_df = time_evol_df[
-                        time_evol_df.date == min(time_evol_df.date)]
+    # Importing geographical shapefile, serialised once per snapshot, so
+    # Bokeh needn't parse the GeoJSON again to validate it
+    with validate(False):
+        geosource = GeoJSONDataSource(
+                        geojson=geojson(datasets, 'world_land', MAP_DETAIL))
 
-    global_by_day_df = pd.read_csv(
-                            f'{s3_root}/data/global_by_day.csv',
-                            storage_options=s3_storage_options)
+    # Detailed land of the continent zoomed into, in place of the world
+    # land outlines filtered out of geo_view
+    detail_geosource = GeoJSONDataSource(geojson=EMPTY_GEOJSON)
+    world_rows = len(simplified(datasets, 'world_land', MAP_DETAIL))
 
-    global_by_day_df.date = pd.to_datetime(global_by_day_df.date, format="%Y-%m-%d")
-    global_totals_df = global_by_day_df.loc[
-                            global_by_day_df.date == min(time_evol_df.date)]
-    global_cases = int(global_totals_df.iloc[0]['cases'])
-    global_deaths = int(global_totals_df.iloc[0]['deaths'])
+    geo_filter = IndexFilter(indices=None)
+    geo_view = CDSView(source=geosource, filters=[geo_filter])
 
-    # Applying bubble-size mapping
-    bubble_size = snapshot_df['cases'].apply(
-                                            lambda x: 0.5*math.log(x, 1.1)
-                                            if x > 0 else 0)
-    snapshot_df = snapshot_df.assign(size=bubble_size.values)
+    # Views only recompute their indices when given new filters, which
+    # would have the server walk every model of the document
+    geo_filter.js_on_change('indices', CustomJS(
+                                            args={'view': geo_view},
+                                            code=RECOMPUTE_VIEW_JS))
+    stages.done('geojson')
+
+    # Importing geo-evolutions cases/deaths data, indexed by date
+    date_index = evolution_index(datasets)
+    stages.done('date_index')
+
+    # Selecting earliest snapshot, with bubble sizes mapped on cases
+    start_date = date_index.dates[0]
+    snapshot = date_index.frame(start_date, "cases")
+
+    global_cases, global_deaths = date_index.totals(start_date)
 
     # Creating ColumnDataSource for visualisation
-    cases_cds = ColumnDataSource(snapshot_df)
+    cases_cds = ColumnDataSource(snapshot)
 
     # Adding figure and geographical patches from shapefile
     geo_plot = figure(plot_height=450,
@@ -75,7 +432,10 @@ def build_time_evolution_tab():
                       name="time_evolution_geo_plot",
                       sizing_mode="scale_width")
 
-    geo_patches = geo_plot.patches('xs', 'ys', source=geosource, alpha=0.5)
+    geo_patches = geo_plot.patches('xs', 'ys', source=geosource,
+                                   view=geo_view, alpha=0.5)
+    detail_patches = geo_plot.patches('xs', 'ys', source=detail_geosource,
+                                      alpha=0.5)
 
     # Adding circle glyph to create bubble plot
     cases_circles = geo_plot.circle(
@@ -91,30 +451,20 @@ def build_time_evolution_tab():
                 tooltips=[
                     ('Country/Region', '@region'),
                     ('Province/State', '@province'),
-                    ('Cases', '@cases')
+                    ('Cases', '@value')
                     ],
                 renderers=[cases_circles])
     geo_plot.add_tools(hover)
+    stages.done('bubble_plot')
 
-    # Adding hbar
-    countries_df = snapshot_df.loc[:, ['date', 'region', 'cases']]
-
-    countries_df.rename(
-                    columns={"cases": "value"},
-                    inplace=True)
-
-    countries_df = countries_df.groupby(
-                                    ['date', 'region']
-                                    ).sum().reset_index()
-
-    countries_df.sort_values(by='value', ascending=False, inplace=True)
-    countries_df = countries_df.reset_index(drop=True)
-    countries_cds = ColumnDataSource(countries_df)
+    # Adding hbar, from precomputed country rankings
+    countries, x_end = date_index.ranking(start_date, "cases")
+    countries_cds = ColumnDataSource(countries)
 
     hbar_plot = figure(plot_height=450,
                        plot_width=475,
-                       y_range=(10.5, -0.5),
-                       x_range=(0, countries_df.value.max()*1.2),
+                       y_range=(TOP_N - 0.5, -0.5),
+                       x_range=(0, x_end),
                        name="time_evolution_hbar_plot",
                        sizing_mode="scale_width")
 
@@ -140,9 +490,11 @@ def build_time_evolution_tab():
                         ('Cases', '@value')],
                     renderers=[hbar])
     hbar_plot.add_tools(hover_hbar)
+    stages.done('hbar_plot')
 
     # Adding callback for updating data
-    def data_view_callback(attr, old, new):
+    @timed('callback', callback='data_view_callback')
+    def update_data_view():
 
         """Callback function to update data source:
 
@@ -167,48 +519,29 @@ def build_time_evolution_tab():
         # Determine date selection
         slider_date = date_slider.value_as_datetime.date()
 
-        # Filter data for selected date
-        snapshot_df = time_evol_df[
-                        time_evol_df.date == pd.Timestamp(slider_date)]
-
-        # Map bubble size on selected data view
-        bubble_size = snapshot_df[data_view].apply(
-                                                lambda x: 0.5*math.log(x, 1.1)
-                                                if x > 0 else 0)
-        snapshot_df = snapshot_df.assign(size=bubble_size.values)
+        # Slice data for selected date, with bubble size mapped on
+        # selected data view
+        snapshot = date_index.frame(slider_date, data_view)
 
-        cases_cds.data = snapshot_df
+        update_source(cases_cds, snapshot)
 
         hover.tooltips = [('Country/Region', '@region'),
                           ('Province/State', '@province'),
                           (data_view.replace('_', ' ').title(),
-                          f'@{data_view}')]
+                          '@value')]
 
         # Update hbar data
-        countries_df = snapshot_df.loc[:, ['date', 'region', data_view]]
-        countries_df.rename(columns={data_view: "value"},
-                            inplace=True)
-
-        countries_df = countries_df.groupby(
-                                        ['date', 'region']
-                                        ).sum().reset_index()
+        countries, x_end = date_index.ranking(slider_date, data_view)
+        update_source(countries_cds, countries)
 
-        countries_df.sort_values(by="value", ascending=False, inplace=True)
-        countries_df = countries_df.reset_index(drop=True)
-        countries_cds.data = countries_df
-
-        hbar_plot.x_range.end = countries_df.value.max()*1.2
+        hbar_plot.x_range.end = x_end
 
         hover_hbar.tooltips = [('Country/Region', '@region'),
                                (data_view.replace('_', ' ').title(),
                                '@value')]
 
-        # Filter for totals
-        global_totals_df = global_by_day_df.loc[
-                            (global_by_day_df.date
-                             == pd.Timestamp(slider_date))]
-        global_cases = int(global_totals_df.iloc[0]['cases'])
-        global_deaths = int(global_totals_df.iloc[0]['deaths'])
+        # Look up totals
+        global_cases, global_deaths = date_index.totals(slider_date)
 
         cases_div.text = (f'<h3 class="card-text">'
                           f'{global_cases:,}</h3>')
@@ -216,9 +549,13 @@ def build_time_evolution_tab():
         deaths_div.text = (f'<h3 class="card-text">'
                            f'{global_deaths:,}</h3>')
 
+    # Updates are rendered on the next tick, coalescing the requests made
+    # in the meantime, with animation paced to the render latency
+    scheduler = CoalescingScheduler(update_data_view)
+
     # Adding Date slider
     date_range = [pd.Timestamp(date_val) for date_val
-                  in time_evol_df.date.unique()]
+                  in date_index.dates]
 
     date_slider = DateSlider(
                     title="Date",
@@ -226,54 +563,47 @@ def build_time_evolution_tab():
                     end=max(date_range),
                     value= min(date_range),
                     sizing_mode="scale_width")
-    date_slider.on_change('value', data_view_callback)
+    # Rendered once a drag ends, and not as animation moves the slider
+    date_slider.on_change('value_throttled', scheduler.on_change)
 
     # Adding Cases/Deaths toggle
     cases_deaths_button = RadioButtonGroup(
                             labels=["Cases", "Deaths"],
                             active=0,
                             sizing_mode="scale_width")
-    cases_deaths_button.on_change('active', data_view_callback)
+    cases_deaths_button.on_change('active', scheduler.on_change)
 
     # Adding Total/New toggle
     total_new_button = RadioButtonGroup(
                             labels=["Total", "New"],
                             active=0,
                             sizing_mode="scale_width")
-    total_new_button.on_change('active', data_view_callback)
+    total_new_button.on_change('active', scheduler.on_change)
 
     # Adding callback for zooming into a selected continent
+    @timed('callback', callback='continent_zoom_callback')
     def continent_zoom_callback(attr, old, new):
 
-        continent_map_ref = {
-                    # Worldwide
-                    0: {'x_range': [-200, 200],
-                        'y_range': [-100, 100]},
-                    # Europe
-                    1: {'x_range': [-30, 50],
-                        'y_range': [30, 70]},
-                    # North America
-                    2: {'x_range': [-175, -15],
-                        'y_range': [0, 80]},
-                    # South America
-                    3: {'x_range': [-140, 10],
-                        'y_range': [-60, 15]},
-                    # Africa
-                    4: {'x_range': [-55, 105],
-                        'y_range': [-40, 40]},
-                    # Asia
-                    5: {'x_range': [40, 140],
-                        'y_range': [-5, 45]},
-                    # Oceania
-                    6: {'x_range': [80, 200],
-                        'y_range': [-55, 5]}}
-            
-        map_ref = continent_map_ref[continent_button.active]
+        map_ref = CONTINENT_RANGES[continent_button.active]
         geo_plot.x_range.start = map_ref['x_range'][0]
         geo_plot.x_range.end = map_ref['x_range'][1]
         geo_plot.y_range.start = map_ref['y_range'][0]
         geo_plot.y_range.end = map_ref['y_range'][1]
 
+        # Detailed land within the continent's ranges, clipped once per
+        # snapshot and shared between sessions, replacing the outlines
+        # crossing them
+        if continent_button.active == 0:
+            hidden, detail_geojson = [], EMPTY_GEOJSON
+        else:
+            hidden, detail_geojson = continent_detail(datasets, map_ref)
+
+        geo_filter.indices = (np.setdiff1d(np.arange(world_rows), hidden)
+                              .tolist() if hidden else None)
+
+        with validate(False):
+            detail_geosource.geojson = detail_geojson
+
     # Adding continent toggle
     continent_button = RadioGroup(
         labels=[
@@ -287,38 +617,109 @@ def build_time_evolution_tab():
             ], active=0)
     continent_button.on_change('active', continent_zoom_callback)
 
+    # Adding Cases/Deaths count
+    cases_div = Div(text=f'<h3 class="card-text">'
+                         f'{global_cases:,}</h3>',
+                    sizing_mode="scale_width",
+                    name="cases_div")
+
+    deaths_div = Div(text=f'<h3 class="card-text">'
+                          f'{global_deaths:,}</h3>',
+                     sizing_mode="scale_width",
+                     name="deaths_div")
+    stages.done('widgets')
+
     # Adding animation with Play/Pause button
     callback_id = None
 
     def animate():
         def animate_update():
-            date = date_slider.value_as_datetime.date() + timedelta(days=1)
-            date = pd.Timestamp(date)
-            if date >= max(date_range):
-                date = min(date_range)
-            date_slider.value = date
-
-        global callback_id
+            nonlocal callback_id
+
+            # This callback has fired, so none is pending until the next
+            # frame is scheduled
+            callback_id = None
+            try:
+                date = (date_slider.value_as_datetime.date()
+                        + timedelta(days=1))
+                date = pd.Timestamp(date)
+                if date >= max(date_range):
+                    date = min(date_range)
+                date_slider.value = date
+
+                # Next frame is scheduled once this one is rendered
+                delay = scheduler.render_frame(ANIMATION_INTERVAL)
+                callback_id = curdoc().add_timeout_callback(
+                                            animate_update, delay)
+            finally:
+                # A frame that failed stops the animation, ready to play
+                if callback_id is None:
+                    play_button.label = '► Play'
+
+        nonlocal callback_id
         if play_button.label == '► Play':
             play_button.label = '❚❚ Pause'
-            callback_id = curdoc().add_periodic_callback(animate_update, 300)
+            callback_id = curdoc().add_timeout_callback(
+                                        animate_update, ANIMATION_INTERVAL)
         else:
             play_button.label = '► Play'
-            curdoc().remove_periodic_callback(callback_id)
+            if callback_id is not None:
+                curdoc().remove_timeout_callback(callback_id)
+                callback_id = None
 
-    play_button = Button(label='► Play', width=60, button_type="success")
-    play_button.on_click(animate)
+    def client_animation_callback(attr, old, new):
 
-    # Adding Cases/Deaths count
-    cases_div = Div(text=f'<h3 class="card-text">'
-                         f'{global_cases:,}</h3>',
-                    sizing_mode="scale_width",
-                    name="cases_div")
+        # Bring server-side data up to date with the paused frame
+        if new == '► Play':
+            scheduler.request()
 
-    deaths_div = Div(text=f'<h3 class="card-text">'
-                          f'{global_deaths:,}</h3>',
-                     sizing_mode="scale_width",
-                     name="deaths_div")
+    play_button = Button(label='► Play', width=60, button_type="success")
+
+    # A static export has no server, so every frame is rendered in the
+    # browser, as for client-side animation
+    if ANIMATION_MODE == 'client' or static:
+        frames = animation_frames(datasets)
+
+        frames_args = {'dates_cds': ColumnDataSource(frames['dates']),
+                       'frames_cds': ColumnDataSource(frames['rows']),
+                       'rankings_cds': ColumnDataSource(frames['ranks']),
+                       'regions': frames['regions'],
+                       'provinces': frames['provinces'],
+                       'interval': ANIMATION_INTERVAL,
+                       'cases_cds': cases_cds,
+                       'countries_cds': countries_cds,
+                       'hbar_plot': hbar_plot,
+                       'cases_div': cases_div,
+                       'deaths_div': deaths_div,
+                       'date_slider': date_slider,
+                       'cases_deaths_button': cases_deaths_button,
+                       'total_new_button': total_new_button,
+                       'play_button': play_button}
+
+        play_button.js_on_click(CustomJS(
+            args=frames_args,
+            code=CLIENT_ANIMATION_JS))
+
+        if static:
+            update = CustomJS(
+                        args=dict(frames_args,
+                                  hover=hover,
+                                  hover_hbar=hover_hbar),
+                        code=CLIENT_UPDATE_JS)
+            date_slider.js_on_change('value', update)
+            cases_deaths_button.js_on_change('active', update)
+            total_new_button.js_on_change('active', update)
+
+            continent_button.js_on_change('active', CustomJS(
+                args={'continent_ranges': CONTINENT_RANGES,
+                      'continent_button': continent_button,
+                      'geo_plot': geo_plot},
+                code=CONTINENT_ZOOM_JS))
+        else:
+            play_button.on_change('label', client_animation_callback)
+    else:
+        play_button.on_click(animate)
+    stages.done('animation')
 
     # Defining layout of tab
     widgets = widgetbox(
@@ -334,3 +735,4 @@ def build_time_evolution_tab():
 
     curdoc().add_root(cases_div)
     curdoc().add_root(deaths_div)
+    stages.done('layout')
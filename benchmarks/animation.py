@@ -0,0 +1,122 @@
+"""Compare server load of server-side and client-side Play animation.
+
+Builds the time evolution tab in each ANIMATION_MODE and plays frames
+through it, reporting server CPU time and websocket payload per frame,
+along with the initial document size. Reads from the bucket configured
+as for the app (DATA_BUCKET_DIR or S3), e.g.
+
+    DATA_BUCKET_DIR=/path/to/bucket python benchmarks/animation.py
+
+Client-side frame rate is logged to the browser console on Pause.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'app'))
+
+from common import patch_bytes  # noqa: E402
+
+
+def run_session_callbacks(document, kind):
+
+    # Stands in for the server's event loop, running due callbacks
+    for callback in list(document.session_callbacks):
+        if isinstance(callback, kind):
+            callback.callback()
+
+
+def run_child(frames):
+
+    from bokeh.document import Document
+    from bokeh.events import ButtonClick
+    from bokeh.io.doc import set_curdoc
+    from bokeh.models import Button, DateSlider
+    from bokeh.server.callbacks import TimeoutCallback
+    import pandas as pd
+    from datasets.store import data_store
+    from tabs import time_evolution
+    from tabs.scheduling import render_stats
+
+    datasets = data_store.snapshot()
+
+    document = Document()
+    set_curdoc(document)
+    time_evolution.build_time_evolution_tab(datasets)
+    document_bytes = len(document.to_json_string())
+
+    date_slider = document.select_one({'type': DateSlider})
+    play_button = document.select_one({'type': Button})
+    hbar_plot = document.get_model_by_name('time_evolution_hbar_plot')
+    cases_div = document.get_model_by_name('cases_div')
+
+    events = []
+    document.on_change(lambda event: events.append(event))
+
+    if time_evolution.ANIMATION_MODE == 'client':
+        play_button.label = '❚❚ Pause'
+    else:
+        play_button._trigger_event(ButtonClick(play_button))
+
+    dates = pd.date_range(pd.Timestamp(date_slider.start, unit='ms'),
+                          pd.Timestamp(date_slider.end, unit='ms'))
+
+    cpu_seconds = 0
+    payload = 0
+    for i in range(frames):
+        events.clear()
+        start = time.process_time()
+
+        # Server mode: a timeout callback moves the slider and renders
+        # the frame. Client mode: the browser syncs the slider, hbar
+        # range and totals it rendered
+        if time_evolution.ANIMATION_MODE == 'client':
+            date_slider.value = dates[(i + 1) % len(dates)]
+            hbar_plot.x_range.end = i + 1
+            cases_div.text = str(i)
+        else:
+            run_session_callbacks(document, TimeoutCallback)
+
+        cpu_seconds += time.process_time() - start
+        payload += patch_bytes(
+                    [event for event in events
+                     if getattr(event, 'model', None) is not date_slider])
+
+    print(json.dumps({'mode': time_evolution.ANIMATION_MODE,
+                      'document_bytes': document_bytes,
+                      'cpu_ms_per_frame': 1000 * cpu_seconds / frames,
+                      'bytes_per_frame': payload / frames,
+                      'render_stats': render_stats()}))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.frames)
+        return
+
+    for mode in ['server', 'client']:
+        output = subprocess.run(
+                    [sys.executable, __file__, '--child',
+                     '--frames', str(args.frames)],
+                    env=dict(os.environ, ANIMATION_MODE=mode),
+                    check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+
+        print(f"{mode:>7}: {result['cpu_ms_per_frame']:.2f} ms CPU and "
+              f"{result['bytes_per_frame'] / 1e3:.1f} kB websocket traffic per frame, "
+              f"initial document {result['document_bytes'] / 1e6:.2f} MB")
+
+
+if __name__ == '__main__':
+    main()
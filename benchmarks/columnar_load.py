@@ -0,0 +1,85 @@
+"""Compare load time and peak memory of the CSV and columnar datasets.
+
+Reads from the bucket configured as for the app (DATA_BUCKET_DIR or S3),
+so run datasets.convert for each format first, e.g.
+
+    DATA_BUCKET_DIR=/path/to/bucket python benchmarks/columnar_load.py
+
+Each format is loaded in a fresh interpreter, so peak RSS is comparable.
+Fails when a columnar format fell back to the CSV of any dataset, whose
+time would otherwise be reported under the columnar format's name.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'app'))
+
+from datasets.loaders import (  # noqa: E402
+    COLUMNAR_DATASETS, data_client, load_dataset)
+from metrics import registry  # noqa: E402
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(data_format):
+
+    client = data_client()
+    baseline = peak_rss_mb()
+    timings = {}
+
+    for name in COLUMNAR_DATASETS:
+        start = time.perf_counter()
+        load_dataset(client, name, data_format=data_format)
+        timings[name] = time.perf_counter() - start
+
+    # Source objects are fetched under the fetch span, columnar versions
+    # under fetch_columnar
+    fetched = {dict(labels).get('dataset')
+               for name, labels in registry.histograms() if name == 'fetch'}
+
+    print(json.dumps({'format': data_format,
+                      'csv_fallbacks': sorted(fetched & set(timings)),
+                      'seconds': timings,
+                      'total_seconds': sum(timings.values()),
+                      'peak_rss_delta_mb': peak_rss_mb() - baseline}))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--formats', nargs='+',
+                        default=['csv', 'parquet', 'arrow'])
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    for data_format in args.formats:
+        output = subprocess.run(
+                    [sys.executable, __file__, '--child', data_format],
+                    check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+
+        if data_format != 'csv' and result['csv_fallbacks']:
+            sys.exit(f"{data_format}: no current columnar copy of "
+                     f"{', '.join(result['csv_fallbacks'])}, run "
+                     f"datasets.convert --format {data_format} first")
+
+        print(f"{data_format:>8}: {result['total_seconds']:.3f}s, "
+              f"peak RSS +{result['peak_rss_delta_mb']:.1f} MB")
+        for name, seconds in result['seconds'].items():
+            print(f"{'':>10}{name}: {seconds:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
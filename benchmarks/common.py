@@ -0,0 +1,38 @@
+"""Helpers shared by the benchmarks, for timings and document patches.
+
+Bokeh is imported when a helper is first called, so scripts can set the
+app's environment variables before it is.
+"""
+import numpy as np
+
+
+def percentiles(seconds, quantiles=(50, 95, 99)):
+    return {f'p{q}_ms': 1000 * float(np.percentile(seconds, q))
+            for q in quantiles}
+
+
+def patch_bytes(events):
+
+    """Websocket bytes of the PATCH-DOC message sending the events."""
+
+    from bokeh.document.events import DocumentPatchedEvent
+    from bokeh.protocol import Protocol
+
+    message = Protocol().create(
+                'PATCH-DOC',
+                [event for event in events
+                 if isinstance(event, DocumentPatchedEvent)])
+
+    return (len(message.content_json)
+            + sum(len(payload) for _, payload in message.buffers))
+
+
+def run_next_tick_callbacks(document):
+
+    from bokeh.server.callbacks import NextTickCallback
+
+    # Stands in for the server's event loop
+    for callback in list(document.session_callbacks):
+        if isinstance(callback, NextTickCallback):
+            document.remove_next_tick_callback(callback)
+            callback.callback()
@@ -0,0 +1,104 @@
+"""Report the latency of finding a local authority from the search input.
+
+Builds the Local UK tab's DistrictFinder, timing its spatial index, then
+times lookups of coordinates inside every authority and at random over
+the boundaries' extent, against a linear point-in-polygon scan of every
+boundary, and lookups of names, exact, by prefix and missing. Reads from
+the bucket configured as for the app (DATA_BUCKET_DIR or S3), e.g.
+
+    DATA_BUCKET_DIR=/path/to/bucket python benchmarks/district_lookup.py
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from shapely.geometry import Point
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'app'))
+
+from datasets.geometry import SpatialIndex  # noqa: E402
+from datasets.store import data_store  # noqa: E402
+from tabs.local_uk import DistrictFinder  # noqa: E402
+
+
+def time_lookups(lookup, queries):
+
+    seconds = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(lookup(query))
+        seconds.append(time.perf_counter() - start)
+
+    return np.array(seconds), results
+
+
+def report(label, seconds):
+    print(f"{label:>24}: median {1e6 * np.median(seconds):8.1f} us, "
+          f"p95 {1e6 * np.percentile(seconds, 95):8.1f} us, "
+          f"max {1e6 * seconds.max():8.1f} us ({len(seconds)})")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=1000,
+                        help="random coordinates looked up")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    la_boundaries_gdf = data_store.snapshot()['la_boundaries']
+    names = la_boundaries_gdf['lad19nm'].to_numpy()
+
+    start = time.perf_counter()
+    index = SpatialIndex(la_boundaries_gdf)
+    finder = DistrictFinder(la_boundaries_gdf, index, [names])
+    print(f"{len(names):,} authorities indexed in "
+          f"{time.perf_counter() - start:.3f}s")
+
+    # Coordinates inside every authority, and anywhere over their extent
+    lat_lon_gdf = la_boundaries_gdf.to_crs('EPSG:4326')
+    inside = [(point.y, point.x) for point
+              in lat_lon_gdf.geometry.representative_point()]
+
+    rng = np.random.default_rng(args.seed)
+    xmin, ymin, xmax, ymax = lat_lon_gdf.total_bounds
+    anywhere = list(zip(rng.uniform(ymin, ymax, args.lookups),
+                        rng.uniform(xmin, xmax, args.lookups)))
+
+    geometry = la_boundaries_gdf.geometry
+    transformer = finder._transformer
+
+    def scan(lat_lon):
+        lat, lon = lat_lon
+        x, y = (transformer.transform(lon, lat)
+                if transformer is not None else (lon, lat))
+        covered = np.flatnonzero(geometry.covers(Point(x, y)).to_numpy())
+        return int(covered[0]) if len(covered) else None
+
+    for label, points in [('inside authorities', inside),
+                          ('anywhere', anywhere)]:
+        indexed_seconds, indexed = time_lookups(
+                                    lambda lat_lon: finder.at(*lat_lon),
+                                    points)
+        scan_seconds, scanned = time_lookups(scan, points)
+
+        report(f"{label}, indexed", indexed_seconds)
+        report(f"{label}, scanned", scan_seconds)
+
+        mismatches = sum(a != b for a, b in zip(indexed, scanned))
+        print(f"{'':>24}  {sum(k is not None for k in indexed):,} found, "
+              f"{mismatches} differing from the scan")
+
+    for label, queries in [
+            ('names, exact', [name.upper() for name in names]),
+            ('names, prefix', [name[:4] for name in names]),
+            ('names, missing', [f'{name} x' for name in names])]:
+        seconds, _ = time_lookups(finder.find, queries)
+        report(label, seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""Write a synthetic copy of the data bucket, of configurable size.
+
+Every dataset the app loads is written under the bucket's keys, with
+cumulative and daily counts consistent with each other, so the directory
+can be served to the app or the benchmarks with DATA_BUCKET_DIR, e.g.
+
+    python benchmarks/fake_bucket.py --dest /tmp/bucket --dates 600
+    DATA_BUCKET_DIR=/tmp/bucket bokeh serve app
+"""
+import argparse
+import os
+import tempfile
+import zipfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Polygon
+
+
+CONTINENTS = ['Africa', 'Asia', 'Europe', 'North America', 'Oceania',
+              'South America']
+
+# Every tenth region is split into provinces
+PROVINCES = ['North', 'South']
+
+# Local authority shown by default in the Local UK tab
+DEFAULT_AREA_NAME = 'Wandsworth'
+
+
+def cumulative(rng, shape, scale):
+
+    """Cumulative counts along the first axis, with their daily change."""
+
+    daily = rng.poisson(scale, shape)
+    return daily.cumsum(axis=0), daily
+
+
+def blob(rng, x, y, radius, vertices):
+
+    """Star-shaped polygon around (x, y), with a wobbly outline."""
+
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = radius * (1 + 0.15 * np.sin(rng.integers(3, 9) * angles))
+
+    return Polygon(np.column_stack([x + radii * np.cos(angles),
+                                    y + radii * np.sin(angles)]))
+
+
+def coverage(rng, columns, rows, extent, vertices):
+
+    """Cells of a jittered grid over extent, sharing wobbly borders.
+
+        Neighbouring cells share their border's vertices exactly, as the
+        authorities of the real boundaries do.
+    """
+
+    xmin, ymin, xmax, ymax = extent
+    width = (xmax - xmin) / columns
+    height = (ymax - ymin) / rows
+
+    corners = np.stack(np.meshgrid(
+                    xmin + width * np.arange(columns + 1),
+                    ymin + height * np.arange(rows + 1)), axis=-1)
+    corners += rng.uniform(-0.2, 0.2, corners.shape) * [width, height]
+
+    steps = np.linspace(0, 1, vertices // 4 + 1)
+    borders = {}
+
+    def border(a, b):
+
+        # Each border is drawn once, from its lower corner, and reversed
+        # for the cell on its other side
+        if a > b:
+            return border(b, a)[::-1]
+
+        if (a, b) not in borders:
+            start, end = corners[a[::-1]], corners[b[::-1]]
+            normal = np.array([start[1] - end[1], end[0] - start[0]])
+            wobble = sum(rng.uniform(-0.03, 0.03) * np.sin(np.pi * k * steps)
+                         for k in range(1, 4))
+            borders[(a, b)] = (start + np.outer(steps, end - start)
+                               + np.outer(wobble, normal))
+
+        return borders[(a, b)]
+
+    cells = []
+    for row in range(rows):
+        for column in range(columns):
+            ring = [(column, row), (column + 1, row),
+                    (column + 1, row + 1), (column, row + 1)]
+            cells.append(Polygon(np.concatenate(
+                            [border(ring[i], ring[(i + 1) % 4])[:-1]
+                             for i in range(4)])))
+
+    return cells
+
+
+def write_shapefile_zip(gdf, path):
+
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    with tempfile.TemporaryDirectory() as shapefile_dir:
+        gdf.to_file(os.path.join(shapefile_dir, f'{name}.shp'))
+
+        with zipfile.ZipFile(path, 'w') as z:
+            for file_name in sorted(os.listdir(shapefile_dir)):
+                z.write(os.path.join(shapefile_dir, file_name), file_name)
+
+
+def global_datasets(rng, dates):
+
+    n = len(dates)
+    cases, new_cases = cumulative(rng, n, 5000)
+    deaths, new_deaths = cumulative(rng, n, 100)
+    vaccinations, daily_vaccinations = cumulative(rng, n, 20000)
+
+    global_by_day_df = pd.DataFrame({
+        'date': dates,
+        'cases': cases,
+        'deaths': deaths,
+        'new_cases': new_cases,
+        'new_deaths': new_deaths,
+        'total_vaccinations': vaccinations.astype(float),
+        'daily_vaccinations': daily_vaccinations.astype(float),
+        'people_vaccinated_per_hundred': np.linspace(0, 60, n),
+        'people_fully_vaccinated_per_hundred': np.linspace(0, 45, n)})
+
+    shape = (n, len(CONTINENTS))
+    continent_dates = np.repeat(dates, len(CONTINENTS))
+    continent_names = np.tile(CONTINENTS, n)
+
+    cases, new_cases = cumulative(rng, shape, 800)
+    deaths, new_deaths = cumulative(rng, shape, 20)
+
+    continents_by_day_df = pd.DataFrame({
+        'date': continent_dates,
+        'continent': continent_names,
+        'cases': cases.ravel(),
+        'new_cases': new_cases.ravel(),
+        'deaths': deaths.ravel(),
+        'new_deaths': new_deaths.ravel()})
+
+    vaccinations, daily_vaccinations = cumulative(rng, shape, 3000)
+
+    vaccinations_df = pd.DataFrame({
+        'date': continent_dates,
+        'continent': continent_names,
+        'total_vaccinations': vaccinations.ravel(),
+        'daily_vaccinations': daily_vaccinations.ravel()})
+
+    return global_by_day_df, continents_by_day_df, vaccinations_df
+
+
+def geo_time_evolution(rng, dates, regions):
+
+    # One row per region, or per province of split regions, each date
+    places = []
+    for i in range(regions):
+        for province in (PROVINCES if i % 10 == 0 else [None]):
+            places.append((f'Country {i}', province,
+                           rng.uniform(-55, 70), rng.uniform(-170, 170)))
+
+    places_df = pd.DataFrame(places,
+                             columns=['region', 'province', 'lat', 'long'])
+
+    shape = (len(dates), len(places_df))
+    cases, new_cases = cumulative(rng, shape, 50)
+    deaths, new_deaths = cumulative(rng, shape, 1)
+
+    time_evol_df = places_df.iloc[np.tile(np.arange(len(places_df)),
+                                          len(dates))].reset_index(drop=True)
+    time_evol_df.insert(0, 'date', np.repeat(dates, len(places_df)))
+    time_evol_df['cases'] = cases.ravel()
+    time_evol_df['deaths'] = deaths.ravel()
+    time_evol_df['new_cases'] = new_cases.ravel()
+    time_evol_df['new_deaths'] = new_deaths.ravel()
+
+    return time_evol_df
+
+
+def local_uk(rng, dates, authorities):
+
+    codes = [f'E{i:08d}' for i in range(authorities)]
+    names = [DEFAULT_AREA_NAME] + [f'Area {i}' for i in range(1, authorities)]
+
+    new_cases = rng.poisson(20, (len(dates), authorities))
+    weekly_cases = (pd.DataFrame(new_cases).rolling(7, min_periods=1)
+                    .sum().to_numpy().astype(int))
+
+    la_cases_df = pd.DataFrame({
+        'date': np.repeat(dates, authorities),
+        'area_name': np.tile(names, len(dates)),
+        'area_code': np.tile(codes, len(dates)),
+        'new_cases': new_cases.ravel(),
+        'weekly_cases': weekly_cases.ravel(),
+        'weekly_average': weekly_cases.ravel() / 7})
+
+    la_pop_df = pd.DataFrame({
+        'code': codes,
+        'name': names,
+        'population': [f'{population:,}' for population
+                       in rng.integers(50000, 500000, authorities)]})
+
+    # Authorities covering Great Britain's extent, in British National Grid
+    # metres as the real boundaries are
+    columns = int(np.ceil(np.sqrt(authorities / 2)))
+    rows = int(np.ceil(authorities / columns))
+
+    la_boundaries_gdf = gpd.GeoDataFrame(
+        {'lad19cd': codes,
+         'lad19nm': names,
+         'lad19nmw': None},
+        geometry=coverage(rng, columns, rows,
+                          (100000, 0, 650000, 1000000),
+                          300)[:authorities],
+        crs='EPSG:27700')
+
+    return la_cases_df, la_pop_df, la_boundaries_gdf
+
+
+def world_land(rng, polygons):
+
+    """Land at the 1:50m and 1:10m scales, as the same wobbly outlines.
+
+        The 1:10m polygons have four times the vertices of the 1:50m ones.
+    """
+
+    centres = [(rng.uniform(-170, 170), rng.uniform(-55, 70),
+                rng.uniform(0.5, 8), rng.integers(2 ** 32))
+               for _ in range(polygons)]
+    scalerank = rng.integers(0, 2, polygons)
+
+    return [gpd.GeoDataFrame(
+                {'featurecla': ['Land'] * polygons,
+                 'scalerank': scalerank},
+                geometry=[blob(np.random.default_rng(seed), x, y, radius,
+                               vertices)
+                          for x, y, radius, seed in centres],
+                crs='EPSG:4326')
+            for vertices in (400, 1600)]
+
+
+def write_bucket(dest, dates=400, regions=200, authorities=380,
+                 land_polygons=300, seed=0):
+
+    """Write every dataset of the bucket under dest, returning its sizes."""
+
+    rng = np.random.default_rng(seed)
+
+    data_dir = os.path.join(dest, 'data')
+    os.makedirs(os.path.join(data_dir, '_geo_data'), exist_ok=True)
+
+    date_strings = (pd.date_range('2020-01-22', periods=dates)
+                    .strftime('%Y-%m-%d'))
+
+    global_by_day_df, continents_by_day_df, vaccinations_df = (
+                                    global_datasets(rng, date_strings))
+    la_cases_df, la_pop_df, la_boundaries_gdf = local_uk(
+                                    rng, date_strings, authorities)
+
+    global_by_day_df.to_csv(
+        os.path.join(data_dir, 'global_by_day.csv'), index=False)
+    continents_by_day_df.to_csv(
+        os.path.join(data_dir, 'continents_by_day.csv'), index=False)
+    vaccinations_df.to_csv(
+        os.path.join(data_dir, 'vaccinations_by_continent_by_day.csv'),
+        index=False)
+    geo_time_evolution(rng, date_strings, regions).to_csv(
+        os.path.join(data_dir, 'geo_time_evolution.csv'), index=False)
+    la_cases_df.to_csv(
+        os.path.join(data_dir, 'local_uk.csv'), index=False)
+    la_pop_df.to_csv(
+        os.path.join(data_dir, 'local_authority_populations.csv'),
+        index=False)
+
+    world_land_gdf, world_land_detailed_gdf = world_land(rng, land_polygons)
+    write_shapefile_zip(
+        world_land_gdf,
+        os.path.join(data_dir, '_geo_data', 'ne_50m_land.zip'))
+    write_shapefile_zip(
+        world_land_detailed_gdf,
+        os.path.join(data_dir, '_geo_data', 'ne_10m_land.zip'))
+    write_shapefile_zip(
+        la_boundaries_gdf,
+        os.path.join(data_dir, '_geo_data', 'la_districts_dec19.zip'))
+
+    return {'dates': dates, 'regions': regions,
+            'authorities': authorities, 'land_polygons': land_polygons}
+
+
+def add_size_arguments(parser):
+    parser.add_argument('--dates', type=int, default=400)
+    parser.add_argument('--regions', type=int, default=200)
+    parser.add_argument('--authorities', type=int, default=380)
+    parser.add_argument('--land-polygons', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dest', required=True,
+                        help="directory to write the bucket to")
+    add_size_arguments(parser)
+    args = parser.parse_args()
+
+    write_bucket(args.dest, args.dates, args.regions, args.authorities,
+                 args.land_polygons, args.seed)
+
+
+if __name__ == '__main__':
+    main()
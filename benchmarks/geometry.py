@@ -0,0 +1,79 @@
+"""Report GeoJSON payload size and build time per level of detail.
+
+Also reports, for each continent zoom of the time evolution map, the
+payload of the detailed land clipped to its ranges against the world land
+at the same level.
+
+Reads from the bucket configured as for the app (DATA_BUCKET_DIR or S3),
+e.g.
+
+    DATA_BUCKET_DIR=/path/to/bucket python benchmarks/geometry.py
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'app'))
+
+from datasets.geometry import (LEVELS_OF_DETAIL, simplify,  # noqa: E402
+                               viewport_detail)
+from datasets.store import data_store  # noqa: E402
+from tabs.time_evolution import (CONTINENT_RANGES, MAP_DETAIL,  # noqa: E402
+                                 ZOOM_DETAIL)
+
+
+def vertex_count(geom):
+
+    if geom is None:
+        return 0
+    if hasattr(geom, 'geoms'):
+        return sum(vertex_count(part) for part in geom.geoms)
+
+    return (len(geom.exterior.coords)
+            + sum(len(ring.coords) for ring in geom.interiors))
+
+
+def main():
+
+    datasets = data_store.snapshot()
+
+    for name in ['world_land', 'world_land_detailed', 'la_boundaries']:
+        print(name)
+
+        for level in LEVELS_OF_DETAIL:
+            start = time.perf_counter()
+            gdf = simplify(datasets[name], level)
+            simplify_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            geojson = gdf.to_json()
+            serialise_seconds = time.perf_counter() - start
+
+            print(f"{level:>10}: {len(geojson) / 1e6:7.2f} MB, "
+                  f"{sum(map(vertex_count, gdf.geometry)):>9,} vertices, "
+                  f"simplified in {simplify_seconds:.2f}s, "
+                  f"serialised in {serialise_seconds:.2f}s")
+
+    world_bytes = len(simplify(datasets['world_land_detailed'], ZOOM_DETAIL)
+                      .to_json())
+    print(f"world_land_detailed within continent ranges ({ZOOM_DETAIL} over "
+          f"{MAP_DETAIL}), against {world_bytes / 1e6:.2f} MB worldwide")
+
+    for map_ref in CONTINENT_RANGES[1:]:
+        bounds = (map_ref['x_range'][0], map_ref['y_range'][0],
+                  map_ref['x_range'][1], map_ref['y_range'][1])
+
+        start = time.perf_counter()
+        hidden, detail_geojson = viewport_detail(
+                                    datasets, bounds,
+                                    ('world_land_detailed', ZOOM_DETAIL),
+                                    ('world_land', MAP_DETAIL))
+        clip_seconds = time.perf_counter() - start
+
+        print(f"{str(bounds):>22}: {len(detail_geojson) / 1e6:7.2f} MB, "
+              f"{len(hidden):>5,} outlines replaced, "
+              f"clipped in {clip_seconds:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
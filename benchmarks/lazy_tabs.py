@@ -0,0 +1,98 @@
+"""Compare session creation time and memory with eager and lazy tabs.
+
+Creates sessions of the app with LAZY_TABS off and on, reporting the
+mean creation time and Python memory held per session, and for lazy
+tabs the time to build each tab on first activation. Reads from the
+bucket configured as for the app (DATA_BUCKET_DIR or S3), e.g.
+
+    DATA_BUCKET_DIR=/path/to/bucket python benchmarks/lazy_tabs.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parents[1] / 'app'
+
+
+def run_child(sessions):
+
+    from bokeh.application import Application
+    from bokeh.application.handlers import DirectoryHandler
+
+    application = Application(DirectoryHandler(filename=str(APP_DIR)))
+
+    # Warm the data store and the structures derived from its snapshot
+    document = application.create_document()
+    for root in document.roots:
+        if 'lazy' in root.tags:
+            root.tags = ['activated']
+
+    start = time.perf_counter()
+    for _ in range(sessions):
+        application.create_document()
+    seconds = (time.perf_counter() - start) / sessions
+
+    # Memory is measured separately, as tracing slows sessions down
+    documents = []
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    for _ in range(sessions):
+        documents.append(application.create_document())
+
+    memory = (tracemalloc.get_traced_memory()[0] - baseline) / sessions
+    tracemalloc.stop()
+
+    activation_seconds = {}
+    for document in documents:
+        for root in list(document.roots):
+            name = root.name
+            if 'lazy' in root.tags and name in (
+                    'local_uk_geo_plot', 'time_evolution_geo_plot'):
+                start = time.perf_counter()
+                root.tags = ['activated']
+                activation_seconds.setdefault(name, []).append(
+                                            time.perf_counter() - start)
+
+    print(json.dumps({
+        'seconds_per_session': seconds,
+        'bytes_per_session': memory,
+        'activation_seconds': {name: sum(values) / len(values)
+                               for name, values
+                               in activation_seconds.items()}}))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.sessions)
+        return
+
+    for mode, lazy_tabs in [('eager', '0'), ('lazy', '1')]:
+        output = subprocess.run(
+                    [sys.executable, __file__, '--child',
+                     '--sessions', str(args.sessions)],
+                    env=dict(os.environ, LAZY_TABS=lazy_tabs),
+                    check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+
+        print(f"{mode:>5}: {1000 * result['seconds_per_session']:.1f} ms "
+              f"and {result['bytes_per_session'] / 1e6:.2f} MB per session")
+        for name, seconds in result['activation_seconds'].items():
+            print(f"{'':>7}{name} built on activation in "
+                  f"{1000 * seconds:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,558 @@
+"""Load test a local server with simulated users, ramping their number up.
+
+Starts the app with app/serve.py on a synthetic bucket (see
+fake_bucket.py), or --bucket, unless --url points at a running server.
+For each number of --users, that many sessions are opened with
+bokeh.client.pull_session, each on its own thread, and run a random
+scripted mix of actions for --duration seconds:
+
+    - moving the time evolution date slider, as at the end of a drag
+    - the cases/deaths and total/new toggles
+    - zooming into a continent
+    - tapping a Local UK district, searching for one by name, and moving
+      its date slider
+    - playing the time evolution animation for a few frames
+
+The round trip of an action lasts until the last property its server
+callback changes has been patched back into the client's document. For
+every step of the ramp the p50/p95/p99 round trip of each action, and the
+server's CPU use and peak RSS (across its worker processes), are printed
+and written as JSON to --output, e.g.
+
+    python benchmarks/load_test.py --users 1 5 10 20 --num-procs 2
+
+Clients share this process, so compare runs made on the same machine,
+with the server's cores left to it.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from bokeh.client import pull_session
+from bokeh.document.events import MessageSentEvent, ModelChangedEvent
+from bokeh.models import ColumnDataSource, HoverTool
+from tornado.ioloop import IOLoop
+
+from common import percentiles
+from fake_bucket import add_size_arguments, write_bucket
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+
+# Relative frequency of each action in the scripted mix
+ACTIONS = {'move_date_slider': 4,
+           'toggle_cases_deaths': 2,
+           'toggle_total_new': 2,
+           'zoom_continent': 2,
+           'tap_district': 3,
+           'search_district': 1,
+           'move_la_date_slider': 2,
+           'play': 1}
+
+# Frames played before pausing the animation
+PLAY_FRAMES = 3
+
+
+class ActionTimeout(Exception):
+    pass
+
+
+def inline_buffers(value, buffers):
+
+    """Replace binary buffer references with base64-encoded arrays."""
+
+    if isinstance(value, dict):
+        if '__buffer__' in value:
+            return dict({key: item for key, item in value.items()
+                         if key != '__buffer__'},
+                        __ndarray__=base64.b64encode(
+                                buffers[value['__buffer__']]).decode())
+        return {key: inline_buffers(item, buffers)
+                for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [inline_buffers(item, buffers) for item in value]
+
+    return value
+
+
+class SimulatedUser:
+
+    """A session of the app, driven as a browser would drive it.
+
+        Changes made here are sent to the server as the browser sends
+        them, and wait_for blocks until the server's patches to the given
+        property have been received.
+    """
+
+    def __init__(self, url, timeout, seed):
+
+        self._timeout = timeout
+        self._random = random.Random(seed)
+        self._patched = set()
+
+        start = time.perf_counter()
+        self.session = pull_session(url=url, io_loop=IOLoop.current())
+        self.open_seconds = time.perf_counter() - start
+
+        # As browsers do, so messages of several frames aren't held back
+        websocket = self.session._connection._socket._socket
+        websocket.protocol.stream.set_nodelay(True)
+
+        # Bokeh's Python client can't decode the binary arrays of column
+        # data patches, which the browser can
+        handle_patch = self.session._handle_patch
+
+        def inline_patch_buffers(message):
+            # Headers are received as JSON text
+            message.content = inline_buffers(
+                                message.content,
+                                {json.loads(header)['id']: payload
+                                 for header, payload in message.buffers})
+            handle_patch(message)
+
+        self.session._handle_patch = inline_patch_buffers
+
+        document = self.session.document
+        document.on_change(self._on_change)
+
+        (self.date_slider, self.cases_deaths_button, self.total_new_button,
+         self.play_button, self.continent_button) = (
+            document.get_model_by_name('time_evolution_widgetbox').children)
+        self.la_date_slider, _, self.search_input = (
+            document.get_model_by_name('local_uk_widgetbox').children)
+
+        self.cases_div = document.get_model_by_name('cases_div')
+        self.geo_plot = document.get_model_by_name('time_evolution_geo_plot')
+        self.hbar_hover = document.get_model_by_name(
+                            'time_evolution_hbar_plot').select_one(
+                                                    {'type': HoverTool})
+        self.trend_plot = document.get_model_by_name('cases_trend_plot')
+        self.geosource = [source for source in document.select(
+                                            {'type': ColumnDataSource})
+                          if 'lad19nm' in source.data][0]
+
+        day = 24 * 3600 * 1000
+        self.dates = np.arange(self.date_slider.start,
+                               self.date_slider.end + day, day)
+        self.la_dates = np.arange(self.la_date_slider.start,
+                                  self.la_date_slider.end + day, day)
+
+        # Column data patches replace the client's columns with the
+        # patched ones, so the authorities are listed up front
+        self.area_names = list(self.geosource.data['lad19nm'])
+        self.authorities = len(self.area_names)
+
+    def _on_change(self, event):
+
+        # Only changes applied from the server's patches
+        if event.setter is not self.session:
+            return
+
+        model = (getattr(event, 'model', None)
+                 or getattr(event, 'column_source', None))
+        if model is not None:
+            self._patched.add((model.id, getattr(event, 'attr', 'data')))
+
+    def wait_for(self, model, attr):
+
+        key = (model.id, attr)
+        connection = self.session._connection
+
+        def patched():
+            return key in self._patched
+
+        # Runs the session's IO loop, reading messages, until patched,
+        # or stops it on timeout
+        timeout = connection.io_loop.call_later(self._timeout,
+                                                connection.io_loop.stop)
+        connection._loop_until(patched)
+        connection.io_loop.remove_timeout(timeout)
+
+        if key not in self._patched:
+            raise ActionTimeout(f"{model} {attr} not patched")
+
+    def act(self, action):
+
+        """Run an action, returning its round trip in seconds."""
+
+        self._patched.clear()
+        start = time.perf_counter()
+
+        seconds = getattr(self, action)()
+
+        return seconds or time.perf_counter() - start
+
+    def _other(self, values, current):
+        return self._random.choice([value for value in values
+                                    if value != current])
+
+    def move_date_slider(self):
+
+        # Sent by the browser as a drag ends, value_throttled being
+        # read-only in Python
+        value = int(self._other(self.dates, self.date_slider.value))
+        self.date_slider.value = value
+        self._send(ModelChangedEvent(self.session.document,
+                                     self.date_slider, 'value_throttled',
+                                     None, value, value))
+
+        # Totals are the last to be updated
+        self.wait_for(self.cases_div, 'text')
+
+    def toggle_cases_deaths(self):
+
+        self.cases_deaths_button.active = 1 - self.cases_deaths_button.active
+
+        # Totals don't change with the data view, the hbar's tooltips do
+        self.wait_for(self.hbar_hover, 'tooltips')
+
+    def toggle_total_new(self):
+        self.total_new_button.active = 1 - self.total_new_button.active
+        self.wait_for(self.hbar_hover, 'tooltips')
+
+    def zoom_continent(self):
+
+        self.continent_button.active = self._other(
+                                range(len(self.continent_button.labels)),
+                                self.continent_button.active)
+
+        # The y range's end is set last, and differs between continents
+        self.wait_for(self.geo_plot.y_range, 'end')
+
+    def tap_district(self):
+
+        self.geosource.selected.indices = [self._other(
+                                range(self.authorities),
+                                (self.geosource.selected.indices or [0])[0])]
+
+        self.wait_for(self.trend_plot.title, 'text')
+
+    def search_district(self):
+
+        # Typed in lower case, and submitted as the input loses focus
+        k = self._other(range(self.authorities),
+                        (self.geosource.selected.indices or [0])[0])
+        self.search_input.value = self.area_names[k].lower()
+
+        self.wait_for(self.trend_plot.title, 'text')
+
+    def move_la_date_slider(self):
+
+        self.la_date_slider.value = int(self._other(
+                                            self.la_dates,
+                                            self.la_date_slider.value))
+
+        self.wait_for(self.geosource, 'data')
+
+    def _send(self, event):
+
+        # Patches the server's document with the event
+        self.session.document._trigger_on_change(event)
+
+    def _click(self, button):
+
+        # Sent by the browser as a bokeh_event message
+        self._send(MessageSentEvent(
+            self.session.document, 'bokeh_event',
+            {'event_name': 'button_click',
+             'event_values': {'model': {'id': button.id}}}))
+
+    def play(self):
+
+        """Round trip to the first frame, then play a few and pause.
+
+            The round trip includes the first ANIMATION_INTERVAL.
+        """
+
+        start = time.perf_counter()
+        self._click(self.play_button)
+        self.wait_for(self.date_slider, 'value')
+        seconds = time.perf_counter() - start
+
+        for _ in range(PLAY_FRAMES - 1):
+            self._patched.clear()
+            self.wait_for(self.date_slider, 'value')
+
+        self._click(self.play_button)
+        self.wait_for(self.play_button, 'label')
+
+        return seconds
+
+    def run(self, until, think_time, result):
+
+        actions = list(ACTIONS)
+        weights = list(ACTIONS.values())
+
+        while time.monotonic() < until:
+            action = self._random.choices(actions, weights)[0]
+
+            try:
+                seconds = self.act(action)
+            except ActionTimeout:
+                result['timeouts'] += 1
+                break
+
+            result['round_trips'].setdefault(action, []).append(seconds)
+            time.sleep(self._random.expovariate(1 / think_time))
+
+        self.session.close()
+
+
+def simulate_user(url, seed, until, think_time, timeout, result):
+
+    # Every session runs its own IO loop, on its user's thread
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    try:
+        user = SimulatedUser(url, timeout, seed)
+    except Exception:
+        result['errors'] += 1
+        return
+
+    result['session_open'].append(user.open_seconds)
+    user.run(until, think_time, result)
+
+
+class ServerMonitor:
+
+    """Samples CPU time and RSS of a process and its children."""
+
+    def __init__(self, pid, interval=0.5):
+
+        self._pid = pid
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.peak_rss = 0
+
+    def _pids(self):
+
+        pids = [self._pid]
+        for pid in pids:
+            try:
+                tasks = os.listdir(f'/proc/{pid}/task')
+            except OSError:
+                continue
+            for task in tasks:
+                try:
+                    with open(f'/proc/{pid}/task/{task}/children') as f:
+                        pids += [int(child) for child in f.read().split()]
+                except OSError:
+                    pass
+
+        return pids
+
+    def sample(self):
+
+        cpu_seconds = 0
+        rss = 0
+        for pid in self._pids():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                with open(f'/proc/{pid}/statm') as f:
+                    pages = int(f.read().split()[1])
+            except OSError:
+                continue
+
+            # utime and stime, in clock ticks
+            cpu_seconds += ((int(fields[11]) + int(fields[12]))
+                            / os.sysconf('SC_CLK_TCK'))
+            rss += pages * os.sysconf('SC_PAGE_SIZE')
+
+        return cpu_seconds, rss
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.peak_rss = max(self.peak_rss, self.sample()[1])
+
+    def start(self):
+
+        self._stop.clear()
+        self._start_cpu, self.peak_rss = self.sample()
+        self._start_time = time.monotonic()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+
+        self._stop.set()
+        self._thread.join()
+
+        cpu_seconds, rss = self.sample()
+
+        return {'cpu_percent': 100 * (cpu_seconds - self._start_cpu)
+                / (time.monotonic() - self._start_time),
+                'peak_rss_mb': max(self.peak_rss, rss) / 1e6,
+                'rss_mb': rss / 1e6}
+
+
+def ramp_step(url, users, duration, think_time, timeout, monitor):
+
+    if monitor:
+        monitor.start()
+
+    until = time.monotonic() + duration
+    results = [{'round_trips': {}, 'session_open': [], 'timeouts': 0,
+                'errors': 0}
+               for _ in range(users)]
+
+    # Every user's session is opened as its thread starts
+    threads = [threading.Thread(target=simulate_user,
+                                args=(url, users * 1000 + i, until,
+                                      think_time, timeout, result))
+               for i, result in enumerate(results)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    round_trips = {}
+    for result in results:
+        for action, seconds in result['round_trips'].items():
+            round_trips.setdefault(action, []).extend(seconds)
+
+    every_action = sum(round_trips.values(), [])
+    open_seconds = sum((result['session_open'] for result in results), [])
+
+    step = {'users': users,
+            'sessions_opened': len(open_seconds),
+            'errors': sum(result['errors'] for result in results),
+            'timeouts': sum(result['timeouts'] for result in results),
+            'actions': len(every_action),
+            'session_open': percentiles(open_seconds or [0]),
+            'round_trip': percentiles(every_action or [0]),
+            'round_trip_by_action': {action: dict(percentiles(seconds),
+                                                  count=len(seconds))
+                                     for action, seconds
+                                     in sorted(round_trips.items())}}
+
+    if monitor:
+        step['server'] = monitor.stop()
+
+    return step
+
+
+def start_server(bucket, port, num_procs):
+
+    env = dict(os.environ, DATA_BUCKET_DIR=bucket)
+    env.pop('DATA_SHARED_DIR', None)
+
+    server = subprocess.Popen(
+                [sys.executable, str(REPO_DIR / 'app' / 'serve.py'),
+                 f'--port={port}', f'--num-procs={num_procs}',
+                 '--allow-websocket-origin=*',
+                 str(REPO_DIR / 'app')],
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+
+    url = f'http://localhost:{port}/app'
+
+    # Ready once the data is loaded and sessions can be opened
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        try:
+            pull_session(url=url).close()
+            return server, url
+        except Exception:
+            if server.poll() is not None:
+                raise RuntimeError("Server exited while starting")
+            time.sleep(1)
+
+    server.terminate()
+    raise RuntimeError("Server did not start")
+
+
+def print_step(step):
+
+    server = step.get('server', {})
+
+    print(f"{step['users']:>4} users: {step['actions']:>5} actions, "
+          f"round trip p50 {step['round_trip']['p50_ms']:7.1f} ms, "
+          f"p95 {step['round_trip']['p95_ms']:7.1f} ms, "
+          f"p99 {step['round_trip']['p99_ms']:7.1f} ms, "
+          f"{step['timeouts']} timeouts, {step['errors']} errors"
+          + (f", server CPU {server['cpu_percent']:.0f}%, "
+             f"peak RSS {server['peak_rss_mb']:.0f} MB" if server else ''))
+
+    for action, stats in step['round_trip_by_action'].items():
+        print(f"{'':>12}{action:<20} p50 {stats['p50_ms']:7.1f} ms, "
+              f"p95 {stats['p95_ms']:7.1f} ms, "
+              f"p99 {stats['p99_ms']:7.1f} ms ({stats['count']})")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+',
+                        default=[1, 5, 10, 20])
+    parser.add_argument('--duration', type=float, default=30,
+                        help="seconds every step of the ramp runs for")
+    parser.add_argument('--think-time', type=float, default=1,
+                        help="mean seconds between a user's actions")
+    parser.add_argument('--timeout', type=float, default=30,
+                        help="seconds to wait for an action's round trip")
+    parser.add_argument('--url',
+                        help="running server to test, e.g. "
+                             "http://localhost:5006/app")
+    parser.add_argument('--bucket',
+                        help="bucket directory to start the server on, "
+                             "instead of a synthetic one")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--num-procs', type=int, default=1)
+    add_size_arguments(parser)
+    parser.add_argument('--output', default='load-test-results.json')
+    args = parser.parse_args()
+
+    server = None
+    monitor = None
+
+    with tempfile.TemporaryDirectory() as bucket:
+        url = args.url
+        if not url:
+            if args.bucket:
+                bucket = args.bucket
+            else:
+                write_bucket(bucket, args.dates, args.regions,
+                             args.authorities, args.land_polygons,
+                             args.seed)
+
+            server, url = start_server(bucket, args.port, args.num_procs)
+            monitor = ServerMonitor(server.pid)
+
+        try:
+            steps = []
+            for users in args.users:
+                step = ramp_step(url, users, args.duration,
+                                 args.think_time, args.timeout, monitor)
+                print_step(step)
+                steps.append(step)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    with open(args.output, 'w') as f:
+        json.dump({'url': url, 'num_procs': args.num_procs,
+                   'duration': args.duration,
+                   'think_time': args.think_time,
+                   'steps': steps}, f, indent=2)
+
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
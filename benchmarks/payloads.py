@@ -0,0 +1,166 @@
+"""Compare websocket bytes per data source update, before and after
+trimming updates to the referenced columns.
+
+"Before" assigns whole DataFrame slices to a data source, as the time
+evolution and local UK tabs used to on every slider tick and map tap.
+"After" drives the tabs' own callbacks. Reads from the bucket configured
+as for the app (DATA_BUCKET_DIR or S3), e.g.
+
+    DATA_BUCKET_DIR=/path/to/bucket python benchmarks/payloads.py
+"""
+import argparse
+import json
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'app'))
+
+import pandas as pd  # noqa: E402
+from bokeh.document import Document  # noqa: E402
+from bokeh.io.doc import set_curdoc  # noqa: E402
+from bokeh.models import ColumnDataSource, DateSlider  # noqa: E402
+
+from common import patch_bytes, run_next_tick_callbacks  # noqa: E402
+from datasets.loaders import DATASETS, data_client, fetch_object  # noqa: E402
+from datasets.store import data_store  # noqa: E402
+from tabs import local_uk, time_evolution  # noqa: E402
+
+
+def source_bytes(document, source, update):
+
+    """Bytes of the patches to a data source sent by one update."""
+
+    events = []
+    document.on_change(events.append)
+    update()
+    document.remove_on_change(events.append)
+
+    return patch_bytes([event for event in events
+                        if getattr(event, 'model', None) is source])
+
+
+def raw_dataset(name):
+    key, parse = DATASETS[name]
+    body, _ = fetch_object(data_client(), key)
+    return parse(body)
+
+
+def mean(values):
+    return sum(values) / len(values) if values else 0
+
+
+def time_evolution_before(updates):
+
+    time_evol_df = raw_dataset('geo_time_evolution')
+    dates = sorted(time_evol_df.date.unique())[:updates + 1]
+
+    def snapshot_df(date):
+        snapshot_df = time_evol_df[time_evol_df.date == date].copy()
+        snapshot_df['size'] = time_evolution.bubble_size(snapshot_df.cases)
+        return snapshot_df
+
+    document = Document()
+    cases_cds = ColumnDataSource(snapshot_df(dates[0]))
+    document.add_root(cases_cds)
+
+    return [source_bytes(document, cases_cds,
+                         lambda: setattr(cases_cds, 'data',
+                                         snapshot_df(date)))
+            for date in dates[1:]]
+
+
+def time_evolution_after(updates):
+
+    document = Document()
+    set_curdoc(document)
+    time_evolution.build_time_evolution_tab(data_store.snapshot())
+
+    cases_cds = [source for source in document.select(
+                                        {'type': ColumnDataSource})
+                 if 'size' in source.data][0]
+    date_slider = document.select_one({'type': DateSlider})
+
+    start = pd.Timestamp(date_slider.start, unit='ms')
+
+    def move_slider(i):
+        # As the browser does at the end of a drag
+        date_slider.value = start + timedelta(days=i)
+        date_slider.trigger('value_throttled', None, date_slider.value)
+        run_next_tick_callbacks(document)
+
+    return [source_bytes(document, cases_cds, lambda: move_slider(i))
+            for i in range(1, updates + 1)]
+
+
+def trend_before(area_names):
+
+    la_cases_df = raw_dataset('local_uk')
+
+    def cases_trend_df(area_name):
+        cases_trend_df = la_cases_df[la_cases_df.area_name == area_name]
+        return cases_trend_df[cases_trend_df.date
+                              >= cases_trend_df.date.max()
+                              - timedelta(days=90)]
+
+    document = Document()
+    cases_trend_cds = ColumnDataSource(cases_trend_df(area_names[0]))
+    document.add_root(cases_trend_cds)
+
+    return [source_bytes(document, cases_trend_cds,
+                         lambda: setattr(cases_trend_cds, 'data',
+                                         cases_trend_df(area_name)))
+            for area_name in area_names[1:]]
+
+
+def trend_after(updates):
+
+    document = Document()
+    set_curdoc(document)
+    local_uk.build_local_uk_tab(data_store.snapshot())
+
+    geosource = [source for source in document.select(
+                                        {'type': ColumnDataSource})
+                 if 'lad19nm' in source.data][0]
+    cases_trend_cds = [source for source in document.select(
+                                        {'type': ColumnDataSource})
+                       if 'weekly_average' in source.data][0]
+
+    def tap(i):
+        geosource.selected.indices = [i]
+
+    sizes = [source_bytes(document, cases_trend_cds, lambda: tap(i))
+             for i in range(1, updates + 1)]
+
+    area_names = ['Wandsworth'] + [geosource.data['area_name'][i]
+                                   for i in range(1, updates + 1)]
+
+    return sizes, area_names
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=20)
+    args = parser.parse_args()
+
+    trend_sizes, area_names = trend_after(args.updates)
+
+    results = {
+        'time_evolution_cases_cds': {
+            'before_bytes': mean(time_evolution_before(args.updates)),
+            'after_bytes': mean(time_evolution_after(args.updates))},
+        'local_uk_cases_trend_cds': {
+            'before_bytes': mean(trend_before(area_names)),
+            'after_bytes': mean(trend_sizes)},
+    }
+
+    for source, sizes in results.items():
+        print(f"{source}: {sizes['before_bytes']:,.0f} -> "
+              f"{sizes['after_bytes']:,.0f} bytes per update")
+
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Compare combined memory of multi-process servers with and without
+memory-mapped shared datasets.
+
+Starts `bokeh serve --num-procs N` on the app, once loading the datasets
+from the bucket in every worker and once memory-mapping the files written
+by datasets.shared, and reports the summed RSS and PSS (proportional set
+size, which splits shared pages between the processes mapping them) of
+the workers once they are serving. Fails when the shared workers' PSS is
+over --max-pss-ratio of the per-process workers'. Linux only, as memory
+is read from /proc. Reads from the bucket configured as for the app, e.g.
+
+    DATA_BUCKET_DIR=/path/to/bucket python benchmarks/shared_memory.py
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parents[1] / 'app'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def memory_kb(pid):
+
+    """(rss, pss) of a process in kilobytes."""
+
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            field, _, rest = line.partition(':')
+            if field in ('Rss', 'Pss'):
+                values[field] = int(rest.split()[0])
+
+    return values['Rss'], values['Pss']
+
+
+def workers(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def wait_until_serving(port, timeout):
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/app', timeout=30)
+            return
+        except OSError:
+            time.sleep(0.5)
+
+    raise TimeoutError(f"server on port {port} did not start")
+
+
+def measure(num_procs, shared_dir, settle, timeout):
+
+    env = dict(os.environ)
+    env.pop('DATA_SHARED_DIR', None)
+    if shared_dir:
+        env['DATA_SHARED_DIR'] = shared_dir
+
+    port = free_port()
+    server = subprocess.Popen(
+                ['bokeh', 'serve', f'--port={port}',
+                 f'--num-procs={num_procs}', str(APP_DIR)],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        wait_until_serving(port, timeout)
+
+        # Every worker loads its datasets on startup, let them finish
+        time.sleep(settle)
+
+        pids = workers(server.pid)
+        rss, pss = zip(*(memory_kb(pid) for pid in pids))
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {'mode': 'shared' if shared_dir else 'per-process',
+            'workers': len(pids),
+            'rss_mb': sum(rss) / 1024,
+            'pss_mb': sum(pss) / 1024}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--num-procs', type=int, default=4)
+    parser.add_argument('--settle', type=float, default=10,
+                        help="seconds to wait for workers to load data")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--max-pss-ratio', type=float, default=0.8,
+                        help="highest PSS of shared workers, as a fraction "
+                             "of per-process workers' PSS")
+    args = parser.parse_args()
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as shared_dir:
+        subprocess.run(
+            [sys.executable, '-m', 'datasets.shared', '--dest', shared_dir],
+            cwd=APP_DIR, check=True, stdout=subprocess.DEVNULL)
+
+        for mode_dir in (None, shared_dir):
+            result = measure(args.num_procs, mode_dir,
+                             args.settle, args.timeout)
+            results[result['mode']] = result
+            print(json.dumps(result))
+
+    ratio = results['shared']['pss_mb'] / results['per-process']['pss_mb']
+    print(f"Shared workers' PSS is {ratio:.2f} of per-process workers'")
+
+    if ratio > args.max_pss_ratio:
+        sys.exit(f"PSS ratio {ratio:.2f} over the maximum "
+                 f"{args.max_pss_ratio:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""Benchmark tab builds, callbacks, memory and payloads on synthetic data.
+
+Writes a synthetic bucket of the given size (see fake_bucket.py) to a
+temporary directory, or uses --bucket, serves it to the app through
+DATA_BUCKET_DIR and measures:
+
+    - the time to load the data store snapshot
+    - per tab builder, the first (cold) and median warm session build
+      times, the document JSON bytes and peak traced Python memory
+    - per widget callback, median and p95 latency and the websocket
+      bytes of its document patches
+    - peak resident memory of the process
+
+Results are written as JSON to --output, with the commit and dataset
+sizes they were measured at. Pass an earlier results file as --baseline
+to print the change of every measurement against it, e.g.
+
+    python benchmarks/suite.py --dates 600 --output after.json \\
+        --baseline before.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from common import patch_bytes, percentiles, run_next_tick_callbacks
+from fake_bucket import add_size_arguments, write_bucket
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+
+sys.path.insert(0, str(REPO_DIR / 'app'))
+
+
+def new_document():
+
+    from bokeh.document import Document
+    from bokeh.io.doc import set_curdoc
+
+    document = Document()
+    set_curdoc(document)
+
+    return document
+
+
+def bench_builds(datasets, repeat):
+
+    from tabs import summary, time_evolution, local_uk
+
+    builders = {'summary': summary.build_summary_tab,
+                'local_uk': local_uk.build_local_uk_tab,
+                'time_evolution': time_evolution.build_time_evolution_tab}
+
+    results = {}
+    for tab, build_tab in builders.items():
+        seconds = []
+        for _ in range(repeat + 1):
+            document = new_document()
+            start = time.perf_counter()
+            build_tab(datasets)
+            seconds.append(time.perf_counter() - start)
+
+        # Traced separately, as tracing slows the build down
+        new_document()
+        tracemalloc.start()
+        build_tab(datasets)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[tab] = dict(percentiles(seconds[1:], (50, 95)),
+                            cold_ms=1000 * seconds[0],
+                            document_bytes=len(document.to_json_string()),
+                            peak_traced_bytes=peak)
+
+    return results
+
+
+def bench_callbacks(datasets, repeat):
+
+    from bokeh.models import ColumnDataSource
+    from tabs import summary, time_evolution, local_uk
+    from tabs.summary import DAY_MS
+
+    document = new_document()
+    summary.build_summary_tab(datasets)
+    local_uk.build_local_uk_tab(datasets)
+    time_evolution.build_time_evolution_tab(datasets)
+
+    (date_slider, cases_deaths_button, total_new_button, _,
+     continent_button) = document.get_model_by_name(
+                                'time_evolution_widgetbox').children
+    la_date_slider, _, search_input = document.get_model_by_name(
+                                'local_uk_widgetbox').children
+    geosource = [source for source in document.select(
+                                        {'type': ColumnDataSource})
+                 if 'lad19nm' in source.data][0]
+
+    dates = np.arange(date_slider.start, date_slider.end + DAY_MS, DAY_MS)
+    la_dates = np.arange(la_date_slider.start, la_date_slider.end + DAY_MS,
+                         DAY_MS)
+    authorities = len(geosource.data['lad19nm'])
+    summary_range = document.get_model_by_name('new_cases_vbar').x_range
+    history_start, history_end = summary_range.start, summary_range.end
+
+    def move_slider(i):
+        # As the browser does at the end of a drag
+        date_slider.value = int(dates[(i + 1) % len(dates)])
+        date_slider.trigger('value_throttled', None, date_slider.value)
+
+    def toggle_cases_deaths(i):
+        cases_deaths_button.active = (i + 1) % 2
+
+    def toggle_total_new(i):
+        total_new_button.active = (i + 1) % 2
+
+    def zoom(i):
+        continent_button.active = (i + 1) % len(continent_button.labels)
+
+    def tap(i):
+        geosource.selected.indices = [(i + 1) % authorities]
+
+    def zoom_summary(i):
+        # Alternately zoomed into a few months, and out to the history
+        if i % 2:
+            summary_range.update(start=history_start, end=history_end)
+        else:
+            summary_range.update(start=history_end - 90 * DAY_MS,
+                                 end=history_end)
+
+    def search(i):
+        # Names typed in lower case, as the trend is updated for a tap
+        search_input.value = geosource.data['lad19nm'][
+                                    (i + 1) % authorities].lower()
+
+    def move_la_slider(i):
+        la_date_slider.value = int(la_dates[-2 - i % (len(la_dates) - 1)])
+
+    actions = {'data_view_slider': move_slider,
+               'data_view_cases_deaths': toggle_cases_deaths,
+               'data_view_total_new': toggle_total_new,
+               'continent_zoom': zoom,
+               'summary_zoom': zoom_summary,
+               'local_uk_tap': tap,
+               'local_uk_search': search,
+               'local_uk_date': move_la_slider}
+
+    results = {}
+    for name, action in actions.items():
+        seconds = []
+        sizes = []
+
+        for i in range(repeat):
+            events = []
+            document.on_change(events.append)
+
+            start = time.perf_counter()
+            action(i)
+            run_next_tick_callbacks(document)
+            seconds.append(time.perf_counter() - start)
+
+            document.remove_on_change(events.append)
+            sizes.append(patch_bytes(events))
+
+        results[name] = dict(percentiles(seconds, (50, 95)),
+                             mean_patch_bytes=float(np.mean(sizes)))
+
+    return results
+
+
+def git_commit():
+
+    try:
+        return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=REPO_DIR, check=True, capture_output=True,
+                text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat):
+
+    from datasets.store import data_store
+
+    start = time.perf_counter()
+    datasets = data_store.snapshot()
+    load_seconds = time.perf_counter() - start
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'sizes': sizes,
+            'repeat': repeat},
+        'load_ms': 1000 * load_seconds,
+        'build': bench_builds(datasets, repeat),
+        'callbacks': bench_callbacks(datasets, repeat),
+        # Linux reports kilobytes
+        'peak_rss_bytes': 1024 * resource.getrusage(
+                                    resource.RUSAGE_SELF).ru_maxrss}
+
+
+def flatten(results, prefix=''):
+
+    values = {}
+    for key, value in results.items():
+        if key == 'meta':
+            continue
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            values[f'{prefix}{key}'] = value
+
+    return values
+
+
+def compare(results, baseline):
+
+    before = flatten(baseline)
+
+    for key, value in flatten(results).items():
+        if not before.get(key):
+            print(f"{key}: {value:,.1f}")
+            continue
+        change = 100 * (value - before[key]) / before[key]
+        print(f"{key}: {before[key]:,.1f} -> {value:,.1f} ({change:+.0f}%)")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bucket',
+                        help="existing bucket directory to benchmark, "
+                             "instead of writing a synthetic one")
+    add_size_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline',
+                        help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as bucket:
+        if args.bucket:
+            bucket = args.bucket
+            sizes = None
+        else:
+            sizes = write_bucket(bucket, args.dates, args.regions,
+                                 args.authorities, args.land_polygons,
+                                 args.seed)
+
+        os.environ['DATA_BUCKET_DIR'] = bucket
+        os.environ.pop('DATA_SHARED_DIR', None)
+
+        results = run(sizes, args.repeat)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    else:
+        compare(results, {})
+
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()